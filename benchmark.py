@@ -0,0 +1,204 @@
+"""
+Benchmarks for the parse -> decode -> export pipeline of patches.py.
+
+Synthetic .PRM banks are generated from the RANGE/VALUES metadata in
+param_definitions and kept between runs. Each pipeline stage is timed
+separately and reported as seconds and patches per second, with peak
+traced memory when --memory is given. Results are saved as JSON so one
+run can be compared with another:
+
+    python benchmark.py --sizes 100 10000 --output before.json
+    python benchmark.py --sizes 100 10000 --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from patch_parameters import PatchParameters as pp, StepSequence
+import patch_writer
+import patches
+
+STEP_FIELDS = StepSequence.RANGES
+
+
+def generate_bank(bank_dir: Path, size, seed=0, default_ratio=0.4, steps=16):
+    # Deterministic random patches; a bank already generated with the same settings is reused
+    settings = {"size": size, "seed": seed, "default_ratio": default_ratio, "steps": steps}
+    marker = bank_dir / ".bank.json"
+    if marker.exists() and json.loads(marker.read_text()) == settings:
+        return
+    bank_dir.mkdir(parents=True, exist_ok=True)
+    for old_file in bank_dir.glob("*.PRM"):
+        old_file.unlink()
+    rnd = random.Random(seed)
+    for i in range(size):
+        lines = []
+        for param, param_def in pp.param_definitions.items():
+            if rnd.random() < default_ratio:
+                value = param_def["DEFAULT"]
+            elif "VALUES" in param_def:
+                value = rnd.choice(list(param_def["VALUES"]))
+            elif "RANGE" in param_def:
+                value = rnd.randint(*param_def["RANGE"])
+            else:
+                value = param_def["DEFAULT"]
+            lines.append(f"{param}={value}")
+        for step in range(1, steps + 1):
+            for field, (lo, hi) in STEP_FIELDS.items():
+                lines.append(f"STEP_{step}_{field}={rnd.randint(lo, hi)}")
+        (bank_dir / f"BENCH{i:07d}.PRM").write_text("\n".join(lines) + "\n")
+    marker.write_text(json.dumps(settings))
+
+
+def measure(stage, memory=False):
+    # Wall time of one call, then peak traced memory of a second call if asked for
+    start = time.perf_counter()
+    stage()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def benchmark_bank(bank_dir: Path, size, work_dir: Path, jobs=1, memory=False):
+    args = patches.parse_app_args(["--file_dir", os.fspath(bank_dir), "--csvname", os.fspath(work_dir / "bench.csv")])
+    args.app_name = "benchmark"
+    args.jobs = jobs
+    app = patches.App(args)
+    parsed = []
+
+    def parse():
+        parsed[:] = app.read_patch_files(app.patch_files)
+
+    def parse_records():
+        # Bytes-level parse into fixed-order int records, for comparison with parse
+        return [pp.get_record_from_file(patch_file) for patch_file in app.patch_files]
+
+    def frame():
+        # Re-use the parsed values so only the DataFrame build is timed
+        app.read_patch_files = lambda patch_files: parsed
+        try:
+            app.load_values()
+        finally:
+            del app.read_patch_files
+
+    def value_matrix():
+        # Dense int32 matrix from the same files, instead of the DataFrame of strings
+        return pp.get_value_matrix_from_files(app.patch_files, jobs=jobs)
+
+    def display_values():
+        # Scalar decoding of every cell, as the pipeline did before it was vectorized
+        for _, parameter_values in parsed[:1000]:
+            for param, value in parameter_values.items():
+                pp.get_display_value(param, value)
+
+    def scan():
+        app.prepare()
+        app.finish_scan()
+
+    def write():
+        # Edited copies, so the generated bank itself stays as it is
+        patch_writer.write_patches(((patch_file, {"LEVEL": 90}) for patch_file in app.patch_files), work_dir / "written")
+
+    stages = {
+        "scan": scan,
+        "parse": parse,
+        "parse_record": parse_records,
+        "frame": frame,
+        "value_matrix": value_matrix,
+        "get_display_value": display_values,
+        "decode": app.build_display,
+        "dump_to_csv": app.dump_to_csv,
+        "stream_to_csv": app.stream_to_csv,
+        "table_to_csv": app.table_to_csv,
+        "write": write,
+    }
+    results = {}
+    for name, stage in stages.items():
+        # The App prints progress and, when streaming, every patch
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            seconds, peak = measure(stage, memory)
+        count = min(size, 1000) if name == "get_display_value" else size
+        results[name] = {
+            "seconds": seconds,
+            "patches_per_second": count / seconds if seconds else None,
+            "peak_bytes": peak,
+        }
+    return results
+
+
+def print_results(results, previous=None):
+    for size, stages in results["sizes"].items():
+        print(f"\n----------------- {size} patches ---------------")
+        for name, result in stages.items():
+            line = f"{name:>18} : {result['seconds']:9.4f} s  {result['patches_per_second'] or 0:12.0f} patches/s"
+            if result["peak_bytes"] is not None:
+                line += f"  {result['peak_bytes'] / 2**20:9.1f} MiB peak"
+            before = (previous or {}).get("sizes", {}).get(size, {}).get(name)
+            if before:
+                line += f"  x{before['seconds'] / result['seconds']:.2f} vs previous"
+            print(line)
+
+
+def parse_bench_args(raw_args):
+    parser = argparse.ArgumentParser(description="Benchmark the patches.py pipeline on synthetic banks")
+    parser.add_argument(
+        "--sizes",
+        help="Bank sizes to benchmark (1000000 works, but generating it takes a while)",
+        type=int,
+        nargs="+",
+        default=[100, 10000],
+    )
+    parser.add_argument(
+        "--bank_dir",
+        help="Where the synthetic banks are generated and kept",
+        default=os.path.join(tempfile.gettempdir(), "s1-benchmark-banks"),
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", "-j", help="Workers for the parse stage", type=int, default=1)
+    parser.add_argument(
+        "--memory",
+        "-m",
+        help="Also record peak traced memory (runs each stage a second time)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument("--output", "-o", help="Save results to this JSON file", default="benchmark.json")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    return parser.parse_args(raw_args)
+
+
+def main(raw_args):
+    args = parse_bench_args(raw_args)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "jobs": args.jobs,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            bank_dir = Path(args.bank_dir, f"bank-{size}-{args.seed}")
+            generate_bank(bank_dir, size, args.seed)
+            results["sizes"][str(size)] = benchmark_bank(bank_dir, size, Path(work_dir), args.jobs, args.memory)
+    previous = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(results, previous)
+    Path(args.output).write_text(json.dumps(results, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
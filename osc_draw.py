@@ -1,54 +1,129 @@
-def integer_to_twos_complement(integer):
-    # Convert the integer to a binary string and remove the '0b' prefix
-    binary_str = format(integer, "b")
+"""
+Oscillator Draw waveforms rendered as single-cycle wavetables.
 
-    # Pad the binary string with leading zeros to ensure it's at least 16 characters long
-    padded_binary_str = binary_str.zfill(16)
+OSC_DRAW_P1..P8 each hold two signed bytes (SPLIT_TC), together the 16
+drawn points of the waveform. OSC_DRAW_SW says how the points are joined
+(Step holds each one, Slope ramps between them) and OSC_DRAW_MULT,
+(N+1)/8, is applied as a gain, clipped to full scale. Gain and clipping
+are applied to a finely sampled cycle, which is then band-limited by
+keeping only its first harmonics; a table whose band-limited peak
+overshoots full scale is scaled back rather than clipped again. Each
+distinct drawing is rendered once however many patches share it.
 
-    # Split the padded binary string into two 8-character substrings
-    first_half = padded_binary_str[:8]
-    second_half = padded_binary_str[8:]
+    python osc_draw.py --file_dir BANK --out_dir TABLES --format wav
+"""
 
-    # Define a helper function to convert an 8-bit binary to two's complement decimal
-    def binary_to_twos_complement(bin_str):
-        # Consider the binary to be negative if it starts with '1'
-        if bin_str[0] == "1":
-            # Convert into a decimal integer by inverting bits and adding 1 (two's complement)
-            return -((int(bin_str, 2) ^ 0xFF) + 1)
-        else:
-            # Simply convert to a decimal integer
-            return int(bin_str, 2)
+import argparse
+import json
+import sys
+import wave
+from pathlib import Path
 
-    # Convert both halves to their two's complement decimal form
-    # The two values are switched in the S-1 e.g., (button2, button1), (button 4, button3)
-    first_decimal = binary_to_twos_complement(second_half)
-    second_decimal = binary_to_twos_complement(first_half)
+import numpy as np
 
-    return first_decimal, second_decimal
+from patch_parameters import PatchParameters
+from patch_scan import scan_patch_files
 
+# The conversions live in PatchParameters; these names are kept for existing callers
+integer_to_twos_complement = PatchParameters.integer_to_twos_complement
+twos_complement_to_integer = PatchParameters.twos_complement_to_integer
 
-# The two values are switched in the S-1 e.g., (button2, button1), (button 4, button3)
-def twos_complement_to_integer(second_decimal, first_decimal):
-    # Define a helper function to convert a signed decimal to an 8-bit binary string
-    def twos_complement_to_binary_string(value):
-        if value < 0:
-            # Calculate the two's complement 8-bit representation of the negative number
-            value = (abs(value) ^ 0xFF) + 1
-        # Convert to binary and extract the last 8 bits (8 characters)
-        return format(value & 0xFF, "08b")
+DRAW_PARAMS = ("OSC_DRAW_SW", "OSC_DRAW_MULT", *(f"OSC_DRAW_P{i}" for i in range(1, 9)))
+STEP, SLOPE = 1, 2
+OVERSAMPLE = 8192  # Samples per cycle before band-limiting
 
-    # Convert both integers to 8-bit binary strings
-    first_half = twos_complement_to_binary_string(first_decimal)
-    second_half = twos_complement_to_binary_string(second_decimal)
 
-    # Concatenate the two binary strings to form a 16-bit binary string
-    combined_binary = first_half + second_half
+def draw_points(matrix):
+    # (n, 16) float points in -1..1 from the (n, 8) OSC_DRAW_P1..P8 columns, in drawing order
+    return PatchParameters.integer_to_twos_complement_batch(matrix).reshape(len(matrix), 16) / 128
 
-    # Convert the 16-bit binary string to an integer
-    result_integer = int(combined_binary, 2)
 
-    return result_integer
+class WavetableRenderer:
+    def __init__(self, size=2048, harmonics=64):
+        self.size = size
+        self.harmonics = min(harmonics, size // 2)
+        self.cache: dict[bytes, np.ndarray] = {}  # drawing (SW, MULT, P1..P8) -> table
 
+    def render_batch(self, drawings):
+        # float32 (n, size) tables for (n, 10) rows of DRAW_PARAMS values
+        points = draw_points(drawings[:, 2:])
+        phase = np.arange(OVERSAMPLE) * 16 / OVERSAMPLE
+        index = phase.astype(np.intp)
+        # Step: hold each point for 1/16 of the cycle. Slope: ramp to the next point, wrapping around.
+        held = points[:, index]
+        ramped = held + (np.roll(points, -1, axis=1)[:, index] - held) * (phase - index)
+        cycles = np.where((drawings[:, :1] == SLOPE), ramped, held)
+        # Clipping adds harmonics, so it comes before the spectrum is cut
+        cycles = np.clip(cycles * (drawings[:, 1:2] + 1) / 8, -1, 1)
+        spectrum = np.fft.rfft(cycles, axis=1)[:, : self.harmonics + 1]
+        spectrum[:, 0] = 0  # No DC offset
+        tables = np.fft.irfft(spectrum, n=self.size, axis=1) * (self.size / OVERSAMPLE)
+        # Ringing and the removed DC can overshoot full scale; scaling keeps the table band-limited
+        peaks = np.abs(tables).max(axis=1, keepdims=True)
+        return (tables / np.maximum(peaks, 1)).astype(np.float32)
 
-for x in (44444, 51387, 58069, 64751, 5641, 12323, 19005, 25687):
-    print(integer_to_twos_complement(x))
+    def render(self, drawings, batch_size=1024):
+        """float32 (n, size) tables for (n, 10) rows of DRAW_PARAMS values, via the cache."""
+        drawings = np.asarray(drawings, dtype=np.int64)
+        uniques, inverse = np.unique(drawings, axis=0, return_inverse=True)
+        keys = [row.tobytes() for row in uniques]
+        missing = [i for i, key in enumerate(keys) if key not in self.cache]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            for i, table in zip(batch, self.render_batch(uniques[batch])):
+                self.cache[keys[i]] = table
+        tables = np.stack([self.cache[key] for key in keys]) if keys else np.empty((0, self.size), np.float32)
+        return tables[inverse.ravel()]
+
+
+def load_drawings(patch_files, jobs=1):
+    # Patch names and DRAW_PARAMS rows of the patches with Oscillator Draw switched on
+    matrix, _, patch_names = PatchParameters.get_value_matrix_from_files(patch_files, DRAW_PARAMS, jobs)
+    on = matrix[:, 0] != 0
+    return patch_names[on], matrix[on]
+
+
+def write_wav(path: Path, table, sample_rate=48000):
+    # One cycle as 16-bit mono PCM, the usual layout for wavetable imports
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((table * 32767).astype("<i2").tobytes())
+
+
+def export(patch_names, drawings, tables, out_dir: Path, file_format="wav"):
+    """Write each distinct table once (WAV per table, or one NPY) plus a JSON of patch -> table."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _, first, inverse = np.unique(drawings, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    patches = {name: int(row) for name, row in zip(np.asarray(patch_names).tolist(), inverse)}
+    if file_format == "npy":
+        np.save(out_dir / "wavetables.npy", tables[first])
+    else:
+        for row, patch_row in enumerate(first):
+            write_wav(out_dir / f"draw{row:05d}.wav", tables[patch_row])
+    (out_dir / "wavetables.json").write_text(json.dumps(patches, indent=1))
+    return len(first)
+
+
+def parse_draw_args(raw_args):
+    parser = argparse.ArgumentParser(description="Render the Oscillator Draw waveforms of a bank as wavetables")
+    parser.add_argument("--file_dir", "-d", help="Directory of .PRM files", required=True)
+    parser.add_argument("--out_dir", "-o", help="Where the tables are written", default="wavetables")
+    parser.add_argument("--format", "-f", choices=("wav", "npy"), default="wav")
+    parser.add_argument("--size", help="Samples per cycle", type=int, default=2048)
+    parser.add_argument("--harmonics", help="Highest harmonic kept", type=int, default=64)
+    parser.add_argument("--recursive", "-r", action="store_true", default=False)
+    parser.add_argument("--glob", action="append")
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    return parser.parse_args(raw_args)
+
+
+if __name__ == "__main__":
+    draw_args = parse_draw_args(sys.argv[1:])
+    patch_files = sorted(scan_patch_files(draw_args.file_dir, draw_args.glob or (), draw_args.recursive))
+    patch_names, drawings = load_drawings(patch_files, draw_args.jobs)
+    tables = WavetableRenderer(draw_args.size, draw_args.harmonics).render(drawings)
+    count = export(patch_names, drawings, tables, Path(draw_args.out_dir), draw_args.format)
+    print(f"{len(patch_names)} patches with Oscillator Draw on, {count} distinct tables in {draw_args.out_dir}")
@@ -0,0 +1,84 @@
+"""
+On-disk cache of parsed patch files, so unchanged files are not re-parsed.
+
+Entries live in a SQLite database and are keyed by the file's resolved path,
+mtime and size, plus a content hash when use_hash is set. Any change to those
+invalidates the entry, and the file is parsed again on the next read.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+from patch_parameters import PatchParameters as pp
+
+# Bump when the parsed output of PatchParameters changes shape
+CACHE_VERSION = 1
+
+
+class PatchCache:
+    def __init__(self, db_path, use_hash=False):
+        self.use_hash = use_hash
+        self.connection = sqlite3.connect(db_path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS patches")
+            self.connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS patches ("
+            " path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT, parameter_values BLOB)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def file_key(self, filepath: Path):
+        stat = os.stat(filepath)
+        digest = None
+        if self.use_hash:
+            digest = hashlib.blake2b(Path(filepath).read_bytes(), digest_size=16).hexdigest()
+        return os.fspath(Path(filepath).resolve()), stat.st_mtime_ns, stat.st_size, digest
+
+    def is_current(self, key):
+        path, mtime_ns, size, digest = key
+        row = self.connection.execute(
+            "SELECT mtime_ns, size, hash FROM patches WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or row[0] != mtime_ns or row[1] != size:
+            return False
+        return digest is None or row[2] == digest
+
+    def load(self, key):
+        row = self.connection.execute(
+            "SELECT parameter_values FROM patches WHERE path = ?", (key[0],)
+        ).fetchone()
+        return json.loads(row[0])
+
+    def store(self, key, parameter_values):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO patches VALUES (?, ?, ?, ?, ?)",
+            (*key, json.dumps(parameter_values, separators=(",", ":")).encode()),
+        )
+
+    def get_parameter_values_from_files(self, filepaths, jobs=1, use_threads=False):
+        # Same contract as PatchParameters.get_parameter_values_from_files: (filepath, values) in order.
+        # Only the stat keys are held for the whole list; values are loaded as they are yielded.
+        keys = [(filepath, self.file_key(filepath)) for filepath in filepaths]
+        current = [self.is_current(key) for _, key in keys]
+        parsed = pp.get_parameter_values_from_files(
+            [filepath for (filepath, _), hit in zip(keys, current) if not hit], jobs, use_threads
+        )
+        try:
+            for count, ((filepath, key), hit) in enumerate(zip(keys, current), 1):
+                if hit:
+                    yield filepath, self.load(key)
+                    continue
+                _, parameter_values = next(parsed)
+                self.store(key, parameter_values)
+                if count % 1000 == 0:
+                    self.connection.commit()
+                yield filepath, parameter_values
+        finally:
+            self.connection.commit()
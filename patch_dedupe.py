@@ -0,0 +1,178 @@
+"""
+Duplicate and near-duplicate detection across patch banks.
+
+Exact duplicates are found in one pass by hashing each patch's parameter
+values in canonical (sorted) order, optionally ignoring some parameters.
+Near duplicates, patches differing in only a few parameters, are grouped
+with MinHash locality-sensitive hashing over their PARAM=VALUE sets, so
+patches are only compared when they land in the same LSH bucket. Bands and
+rows are chosen from `near` and the number of parameters, so buckets are
+shared from about the similarity of patches `near` parameters apart. Each
+pair is compared once, as rows of an int matrix of value codes.
+"""
+
+import csv
+import hashlib
+import math
+
+import numpy as np
+
+
+def canonical_values(parameter_values: dict, ignore=()):
+    # Sorted PARAM=VALUE pairs; numeric values normalized so "016" and "16" agree
+    canonical = {}
+    for param, value in parameter_values.items():
+        if param in ignore:
+            continue
+        try:
+            value = str(int(value))
+        except ValueError:
+            pass
+        canonical[param] = value
+    return sorted(canonical.items())
+
+
+def patch_hash(parameter_values: dict, ignore=()):
+    text = "\n".join(f"{param}={value}" for param, value in canonical_values(parameter_values, ignore))
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def differences(values_a: dict, values_b: dict, ignore=()):
+    params = (values_a.keys() | values_b.keys()) - set(ignore)
+    return sorted(param for param in params if values_a.get(param) != values_b.get(param))
+
+
+def lsh_shape(params, near, miss=0.001):
+    # (bands, rows) for MinHash LSH over sets of `params` PARAM=VALUE tokens. Patches `near`
+    # parameters apart have Jaccard similarity (params - near) / (params + near); rows are as many
+    # as keep that pair's chance of agreeing on a whole band at least 1/2, and bands as many as
+    # bring its chance of sharing no bucket down to `miss`.
+    similarity = (params - near) / (params + near) if params > near else 0.0
+    if similarity <= 0:
+        return 1, 1
+    if similarity >= 1:
+        return 1, 64
+    rows = max(1, int(math.log(0.5) / math.log(similarity)))
+    bands = max(1, math.ceil(math.log(miss) / math.log(1 - similarity**rows)))
+    return bands, rows
+
+
+def value_matrix(representatives):
+    # Patches x params int codes of the canonical values; -1 where a patch doesn't set a param
+    params = sorted({param for values in representatives for param in values})
+    matrix = np.full((len(representatives), len(params)), -1, dtype=np.int64)
+    for column, param in enumerate(params):
+        codes = {}
+        for row, values in enumerate(representatives):
+            if param in values:
+                matrix[row, column] = codes.setdefault(values[param], len(codes))
+    return matrix
+
+
+class DuplicateFinder:
+    def __init__(self, ignore=(), near=0, bands=None, rows=None, seed=0):
+        # near: largest number of differing parameters still counted as a near duplicate.
+        # bands and rows (of the MinHash signature) are derived from near unless given.
+        self.ignore = set(ignore)
+        self.near = near
+        self.bands = bands
+        self.rows = rows
+        self.rng = np.random.default_rng(seed)
+        self.groups: dict[str, list[str]] = {}  # hash -> patch names, in the order added
+        self.representatives: dict[str, dict] = {}  # hash -> canonical values of its first patch
+
+    def add(self, patch_name, parameter_values: dict):
+        digest = patch_hash(parameter_values, self.ignore)
+        self.groups.setdefault(digest, []).append(patch_name)
+        if self.near and digest not in self.representatives:
+            self.representatives[digest] = dict(canonical_values(parameter_values, self.ignore))
+
+    def exact_clusters(self):
+        return [names for names in self.groups.values() if len(names) > 1]
+
+    def minhash_signatures(self, digests, num_perm):
+        # One row of num_perm minimums per representative, over integer ids of its PARAM=VALUE tokens
+        vocabulary = {}
+        token_ids = [
+            np.array(
+                [vocabulary.setdefault(token, len(vocabulary)) for token in self.representatives[digest].items()],
+                dtype=np.uint64,
+            )
+            for digest in digests
+        ]
+        # Multiply-add hashing with odd multipliers, wrapping at 64 bits
+        a = self.rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        b = self.rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        signatures = np.empty((len(digests), num_perm), dtype=np.uint64)
+        for i, ids in enumerate(token_ids):
+            if len(ids):
+                signatures[i] = (ids[:, None] * a + b).min(axis=0)
+            else:
+                signatures[i] = np.iinfo(np.uint64).max
+        return signatures
+
+    def near_clusters(self):
+        # Union-find over exact-duplicate groups, joined when they share an LSH bucket
+        # and differ in at most `near` parameters.
+        digests = list(self.representatives)
+        parents = list(range(len(digests)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        representatives = [self.representatives[digest] for digest in digests]
+        params = round(np.mean([len(values) for values in representatives])) if digests else 0
+        bands, rows = lsh_shape(params, self.near)
+        bands, rows = self.bands or bands, self.rows or rows
+        signatures = self.minhash_signatures(digests, bands * rows)
+        matrix = value_matrix(representatives)
+        compared = set()  # (earlier, other) pairs already diffed, in any band
+        for band in range(bands):
+            buckets = {}
+            for i, key in enumerate(map(bytes, signatures[:, band * rows : (band + 1) * rows])):
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                # Every pair in the bucket not yet joined: a member far from one may be near another
+                for n, other in enumerate(members[1:], 1):
+                    root = find(other)
+                    earlier = [i for i in members[:n] if (i, other) not in compared and find(i) != root]
+                    if not earlier:
+                        continue
+                    compared.update((i, other) for i in earlier)
+                    counts = (matrix[earlier] != matrix[other]).sum(axis=1)
+                    for i in np.asarray(earlier)[counts <= self.near].tolist():
+                        parents[find(i)] = find(other)
+
+        clusters = {}
+        for i, digest in enumerate(digests):
+            clusters.setdefault(find(i), []).append(digest)
+        return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+    def clusters(self):
+        """(kind, [(patch_name, differing params vs. the first patch)]) for each cluster of 2+ patches."""
+        result = []
+        grouped = set()
+        if self.near:
+            for digests in self.near_clusters():
+                first = self.representatives[digests[0]]
+                members = []
+                for digest in digests:
+                    diff = differences(first, self.representatives[digest])
+                    members.extend((name, diff) for name in self.groups[digest])
+                    grouped.add(digest)
+                result.append(("near", members))
+        for digest, names in self.groups.items():
+            if len(names) > 1 and digest not in grouped:
+                result.append(("exact", [(name, []) for name in names]))
+        return result
+
+    def write_csv(self, csvname):
+        with open(csvname, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow(["CLUSTER", "KIND", "PATCH", "DIFFERENCES"])
+            for cluster, (kind, members) in enumerate(self.clusters(), 1):
+                for patch_name, diff in members:
+                    writer.writerow([cluster, kind, patch_name, " ".join(diff)])
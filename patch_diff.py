@@ -0,0 +1,83 @@
+"""
+Differences between two patches, or between two versions of a bank.
+
+Patches are compared as rows of PatchParameters.get_value_matrix, so an
+unset parameter compares equal to its DEFAULT. Banks are aligned by patch
+name and all their cells compared in one vectorized step; only the cells
+that changed are decoded for display.
+"""
+
+import numpy as np
+
+from patch_parameters import PatchParameters as pp
+
+
+class BankDiff:
+    def __init__(self, matrix_a, names_a, matrix_b, names_b, params):
+        # matrix_*: patches x params int matrices with the same params, rows named by names_*
+        self.params = np.asarray(params)
+        self.positions = {param: i for i, param in enumerate(self.params.tolist())}
+        common, rows_a, rows_b = np.intersect1d(names_a, names_b, assume_unique=True, return_indices=True)
+        self.only_a = np.setdiff1d(names_a, common, assume_unique=True)
+        self.only_b = np.setdiff1d(names_b, common, assume_unique=True)
+        values_a = matrix_a[rows_a]
+        values_b = matrix_b[rows_b]
+        # Changed cells in (patch name, param order), as parallel arrays
+        patches, columns = np.nonzero(values_a != values_b)
+        self.rows_a, self.rows_b, self.patch_rows = values_a, values_b, patches
+        self.patch_names = common[patches]
+        self.changed_params = self.params[columns]
+        self.values_a = values_a[patches, columns]
+        self.values_b = values_b[patches, columns]
+
+    def changed_patches(self):
+        return np.unique(self.patch_names)
+
+    def context(self, rows, row, param):
+        # The patch's controlling value for a DEPENDS parameter, as get_display_value takes it
+        controller = pp.dependencies[param][0] if param in pp.dependencies else None
+        if controller not in self.positions:
+            return None
+        return {controller: str(rows[row, self.positions[controller]])}
+
+    def changes(self):
+        """(patch_name, param, display value in A, display value in B) for each changed cell;
+        None where the parameter is inactive in that patch."""
+        for patch_name, row, param, value_a, value_b in zip(
+            self.patch_names.tolist(),
+            self.patch_rows.tolist(),
+            self.changed_params.tolist(),
+            self.values_a.tolist(),
+            self.values_b.tolist(),
+        ):
+            yield (
+                patch_name,
+                param,
+                pp.get_display_value(param, str(value_a), self.context(self.rows_a, row, param)),
+                pp.get_display_value(param, str(value_b), self.context(self.rows_b, row, param)),
+            )
+
+    def print(self, label_a="A", label_b="B", summary=True):
+        for label, names in ((label_a, self.only_a), (label_b, self.only_b)):
+            if len(names):
+                print(f"\n----------------- Only in {label} ---------------")
+                print(" ".join(names.tolist()))
+        current = None
+        for patch_name, param, display_a, display_b in self.changes():
+            if patch_name != current:
+                print(f"\n----------------- {patch_name} ---------------")
+                current = patch_name
+            param_def = pp.param_definitions[param]
+            display_a, display_b = ("(inactive)" if value is None else value for value in (display_a, display_b))
+            print(f'{param_def["NAME"]} ={param_def["LOCATION"]}= : {display_a} -> {display_b}')
+        if summary:
+            print(
+                f"\n{len(self.changed_patches())} patches changed ({len(self.patch_names)} values),"
+                f" {len(self.only_a)} only in {label_a}, {len(self.only_b)} only in {label_b}"
+            )
+
+
+def diff_patches(matrix, params, label):
+    # Two patches as the two rows of one matrix, compared as banks of one patch named label
+    names = np.array([label])
+    return BankDiff(matrix[:1], names, matrix[1:2], names, params)
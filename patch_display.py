@@ -0,0 +1,157 @@
+"""
+Columnar conversion of raw patch values into human-readable display values.
+
+Each parameter row (one raw value per patch) is converted in a single pass
+instead of calling PatchParameters.get_display_value once per cell.
+Parameters with a DEPENDS entry are decoded in one pass per controlling
+value. The results match get_display_values exactly.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from patch_parameters import PatchParameters as pp
+
+# COMB and MULT are 0-255, so their (float) results are tabulated once.
+# Built with the same expressions as the decoders so rounding matches.
+_COMB_TABLE = np.array([math.ceil((v / 8) * 10) / 10 for v in range(256)])
+_MULT_TABLE = np.array([round((v + 1) / 8, 1) for v in range(256)])
+
+
+def _decode_unique(values: pd.Series, decode) -> pd.Series:
+    # Decode each distinct raw value once, then broadcast back over the row
+    codes, uniques = pd.factorize(values)
+    decoded = np.empty(len(uniques) + 1, dtype=object)
+    for i, unique in enumerate(uniques):
+        decoded[i] = decode(unique)
+    # factorize marks missing values with -1, which lands on the last slot
+    decoded[-1] = pd.NA
+    return pd.Series(decoded[codes], index=values.index)
+
+
+def _in_range(numbers: pd.Series, size) -> bool:
+    raw = numbers.to_numpy()
+    return len(raw) and not np.isnan(raw).any() and raw.min() >= 0 and raw.max() < size
+
+
+def _decode_table(values: pd.Series, numbers: pd.Series, table, decode) -> pd.Series:
+    if not _in_range(numbers, len(table)):
+        return _decode_unique(values, decode)
+    return pd.Series(table[numbers.to_numpy().astype(np.intp)], index=values.index)
+
+
+def _decode_split_tc(values: pd.Series, numbers: pd.Series, decode) -> pd.Series:
+    if not _in_range(numbers, 0x10000):
+        return _decode_unique(values, decode)
+    pairs = pp.integer_to_twos_complement_batch(numbers.to_numpy().astype(np.int64)).tolist()
+    display = np.empty(len(pairs), dtype=object)
+    display[:] = [tuple(pair) for pair in pairs]
+    return pd.Series(display, index=values.index)
+
+
+def _decode_chop(values: pd.Series, numbers: pd.Series, decode) -> pd.Series:
+    if not _in_range(numbers, 0x10000):
+        return _decode_unique(values, decode)
+    return pd.Series(pp.chop_pattern_batch(numbers.to_numpy().astype(np.int64)), index=values.index)
+
+
+def _decode_row(param_def, decode, values: pd.Series, numbers: pd.Series) -> pd.Series:
+    match param_def["TYPE"]:
+        case "INT":
+            display = values.astype(object)
+        case "DICT":
+            display = _decode_unique(values, decode)
+        case "DIV100":
+            display = numbers / 100
+        case "COMB":
+            display = _decode_table(values, numbers, _COMB_TABLE, decode)
+        case "MULT":
+            display = _decode_table(values, numbers, _MULT_TABLE, decode)
+        case "SPLIT_TC":
+            display = _decode_split_tc(values, numbers, decode)
+        case "CHOP":
+            display = _decode_chop(values, numbers, decode)
+        case _:
+            # Unknown types: few distinct values per bank
+            display = _decode_unique(values, decode)
+    return display
+
+
+def _decode_dependent(param, values: pd.Series, numbers: pd.Series, controls) -> pd.Series:
+    # Group the patches by their controlling value and decode each group as that case says
+    controller, cases, controller_default = pp.dependencies[param]
+    if controls is None:
+        control_numbers = np.full(len(values), float(controller_default))
+    else:
+        control_numbers = pd.to_numeric(controls, errors="coerce").fillna(controller_default).to_numpy(np.float64)
+    display = pd.Series(pd.NA, index=values.index, dtype=object)
+    for case in np.unique(control_numbers):
+        case_def, decode = cases.get(int(case), (pp.param_definitions[param], pp.decoders[param]))
+        if decode is None:
+            # Inactive in these patches
+            continue
+        mask = control_numbers == case
+        display[mask] = _decode_row(case_def, decode, values[mask], numbers[mask]).astype(object).to_numpy()
+    return display
+
+
+def _is_int(value) -> bool:
+    try:
+        int(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _not_int(values: pd.Series) -> np.ndarray:
+    # Mask of the values int() rejects, checked once per distinct value; missing ones are False
+    codes, uniques = pd.factorize(values)
+    flags = np.array([not _is_int(unique) for unique in uniques] + [False])
+    return flags[codes]
+
+
+def display_row(param, values: pd.Series, keep_defaults=False, controls=None) -> pd.Series:
+    """Display values for one parameter across many patches; controls holds the raw values of
+    its controlling parameter, for parameters with a DEPENDS entry. Values that aren't integers
+    are shown as they are and never blanked, as in PatchParameters.get_display_values."""
+    raw = _not_int(values)
+    if raw.any():
+        display = pd.Series(values.to_numpy(dtype=object), index=values.index, dtype=object)
+        keep = ~raw
+        if controls is not None:
+            controls = controls[keep]
+        display[keep] = display_row(param, values[keep], keep_defaults, controls).to_numpy()
+        return display
+
+    numbers = pd.to_numeric(values, errors="coerce").astype(np.float64)
+    if param in pp.dependencies:
+        display = _decode_dependent(param, values, numbers, controls)
+    else:
+        display = _decode_row(pp.param_definitions[param], pp.decoders[param], values, numbers)
+
+    display = display.astype(object)
+    if not keep_defaults:
+        display[numbers.to_numpy() == pp.int_defaults[param]] = pd.NA
+    return display
+
+
+def display_frame(values_df: pd.DataFrame, keep_defaults=False) -> pd.DataFrame:
+    """Display values for a parameters x patches frame of raw values."""
+
+    def controls(param):
+        controller = pp.dependencies[param][0] if param in pp.dependencies else None
+        return values_df.loc[controller] if controller in values_df.index else None
+
+    # Keys outside param_definitions are left out, as PatchParameters.get_display_values never asks for them
+    rows = {
+        param: display_row(param, values, keep_defaults, controls(param))
+        for param, values in values_df.iterrows()
+        if param in pp.param_definitions
+    }
+    if not rows:
+        return pd.DataFrame(index=values_df.index, columns=values_df.columns, dtype=object)
+    # One column per parameter, then transposed; cheaper than from_dict(orient="index"), which goes cell by cell
+    return pd.concat(rows, axis=1).T
+
@@ -0,0 +1,121 @@
+"""
+Typed, columnar export of a patch bank: one row per patch, one column per parameter.
+
+Raw values are stored in the narrowest integer dtype that holds them and DICT
+parameters become dictionary-encoded categoricals of their display names.
+Parquet and Arrow files need pyarrow; without it the bank is written as a
+memory-mappable NumPy structured array (.npy) plus a JSON file describing
+the columns.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from patch_parameters import PatchParameters as pp
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow", "npy": ".npy"}
+
+
+def narrow_dtype(values: np.ndarray):
+    # Smallest integer dtype holding every value
+    if not len(values):
+        return np.dtype(np.int8)
+    return np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()))
+
+
+def raw_column(param, values: pd.Series) -> np.ndarray:
+    # Missing or non-numeric values fall back to the parameter's DEFAULT
+    numbers = pd.to_numeric(values, errors="coerce").fillna(pp.int_defaults[param]).to_numpy(np.int64)
+    return numbers.astype(narrow_dtype(numbers))
+
+
+def dict_column(param, values: pd.Series) -> pd.Categorical:
+    raw = values.fillna(str(pp.param_definitions[param]["DEFAULT"]))
+    codes, uniques = pd.factorize(raw)
+    names = [pp.decoders[param](unique) for unique in uniques]
+    # Keep the full VALUES dictionary, plus any raw values it does not cover
+    categories = list(dict.fromkeys([*pp.param_definitions[param]["VALUES"].values(), *names]))
+    return pd.Categorical(np.asarray(names, dtype=object)[codes], categories=categories)
+
+
+def typed_frame(values_df: pd.DataFrame, params) -> pd.DataFrame:
+    """Patches x parameters frame of typed values, from a parameters x patches frame of raw strings."""
+    values_df = values_df.reindex(params)
+    columns = {}
+    for param in params:
+        # A DEPENDS parameter's meaning varies by patch, so it stays raw next to its controlling column
+        if pp.param_definitions[param]["TYPE"] == "DICT" and param not in pp.dependencies:
+            columns[param] = dict_column(param, values_df.loc[param])
+        else:
+            columns[param] = raw_column(param, values_df.loc[param])
+    return pd.DataFrame(columns, index=pd.Index(values_df.columns, name="PATCH"))
+
+
+def write_npy(values_df: pd.DataFrame, params, path: Path):
+    # A structured array can be opened with np.load(path, mmap_mode="r").
+    # DICT columns keep their raw values; the JSON file has the VALUES to decode them.
+    values_df = values_df.reindex(params)
+    patches = np.asarray(values_df.columns, dtype=str)
+    columns = {param: raw_column(param, values_df.loc[param]) for param in params}
+    dtype = [("PATCH", patches.dtype)] + [(param, column.dtype) for param, column in columns.items()]
+    records = np.empty(len(patches), dtype=dtype)
+    records["PATCH"] = patches
+    for param, column in columns.items():
+        records[param] = column
+    np.save(path, records)
+    columns_path = path.with_suffix(".json")
+    columns_path.write_text(
+        json.dumps(
+            {
+                param: {
+                    key: pp.param_definitions[param][key]
+                    for key in ("NAME", "TYPE", "VALUES")
+                    if key in pp.param_definitions[param]
+                }
+                for param in params
+            },
+            indent=1,
+        )
+    )
+
+
+def export(values_df: pd.DataFrame, params, csvname, file_format) -> Path:
+    """Write the bank next to csvname in file_format and return the path written."""
+    if file_format in ("parquet", "arrow") and pa is None:
+        logging.warning(f"pyarrow is not installed, writing {file_format} as npy instead")
+        file_format = "npy"
+    path = Path(csvname).with_suffix(SUFFIXES[file_format])
+    match file_format:
+        case "parquet":
+            pq.write_table(pa.Table.from_pandas(typed_frame(values_df, params)), path)
+        case "arrow":
+            # Uncompressed so the file can be memory-mapped without copying
+            feather.write_feather(typed_frame(values_df, params), path, compression="uncompressed")
+        case "npy":
+            write_npy(values_df, params, path)
+    return path
+
+
+def load(path):
+    """Open an exported bank: a pyarrow Table for parquet/arrow, a memory-mapped record array for npy."""
+    path = Path(path)
+    match path.suffix:
+        case ".parquet":
+            return pq.read_table(path, memory_map=True)
+        case ".arrow":
+            # Zero-copy: columns point into the mapped file
+            return feather.read_table(path, memory_map=True)
+        case ".npy":
+            return np.load(path, mmap_mode="r")
+    raise ValueError(f"Unknown bank format: {path}")
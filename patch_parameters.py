@@ -1,17 +1,119 @@
+from array import array
+from collections import deque
+from collections.abc import Mapping
+import graphlib
 import logging
 import math
 from pathlib import Path
 import re
 
 
+class StepSequence:
+    # Sequencer data of one patch: one compact int array per step field, indexed by step.
+    # Accepts STEP_<n>_<FIELD>, STEP_<FIELD>_<n> and STEP_<FIELD><n> keys.
+    STEP_KEY = re.compile(r"STEP_(?:(\d+)_(\w+)|(\w+?)_?(\d+))")
+    # Allowed values of the known fields, for --validate; other fields only need to be integers
+    RANGES = {"NOTE": (0, 127), "VELO": (1, 127), "GATE": (0, 100)}
+
+    def __init__(self, step_values: dict[str, dict[int, int]]):
+        steps = [step for field_steps in step_values.values() for step in field_steps]
+        self.first_step = min(steps, default=1)
+        self.length = max(steps, default=0) - self.first_step + 1 if steps else 0
+        self.fields: dict[str, array] = {}
+        for field, field_steps in step_values.items():
+            values = [field_steps.get(step, 0) for step in range(self.first_step, self.first_step + self.length)]
+            typecode = "h" if all(-32768 <= value <= 32767 for value in values) else "i"
+            self.fields[field] = array(typecode, values)
+
+    @staticmethod
+    def parse_key(key):
+        # "STEP_3_NOTE" -> (3, "NOTE"), None if the key has no step number
+        match = StepSequence.STEP_KEY.fullmatch(key)
+        if not match:
+            return None
+        if match[1]:
+            return int(match[1]), match[2]
+        return int(match[4]), match[3]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def step(self, step):
+        return {field: values[step - self.first_step] for field, values in self.fields.items()}
+
+    def __str__(self):
+        # Compact text for CSV export, e.g. "NOTE:60 62 64;GATE:50 50 80"
+        return ";".join(f"{field}:{' '.join(map(str, values))}" for field, values in self.fields.items())
+
+
+class Patch(Mapping):
+    # Parameter values of one patch in a single int array, in PatchParameters.record_params order.
+    # Reads like the dict of strings from get_parameter_values_from_file, so it can stand in
+    # for one; unset parameters hold the typecode's MISSING value. Values that aren't ints
+    # (or don't fit 32 bits) are kept as text in extras.
+    __slots__ = ("values", "extras")
+    MISSING = {"h": -0x8000, "i": -0x80000000}
+
+    def __init__(self, record):
+        ints = [value if isinstance(value, int) and -0x7FFFFFFF <= value <= 0x7FFFFFFF else None for value in record]
+        self.extras = {
+            PatchParameters.record_params[position]: str(value)
+            for position, (value, number) in enumerate(zip(record, ints))
+            if number is None and value is not None
+        } or None
+        typecode = "h" if all(number is None or -0x7FFF <= number <= 0x7FFF for number in ints) else "i"
+        missing = Patch.MISSING[typecode]
+        self.values = array(typecode, [missing if number is None else number for number in ints])
+
+    @staticmethod
+    def from_file(filepath: Path):
+        return Patch(PatchParameters.get_record_from_file(filepath))
+
+    @staticmethod
+    def from_values(parameter_values: dict):
+        # Keys outside param_definitions have no place in the record and are dropped
+        record = [None] * len(PatchParameters.record_params)
+        for param, value in parameter_values.items():
+            position = PatchParameters.record_index.get(param)
+            if position is not None:
+                try:
+                    record[position] = int(value)
+                except ValueError:
+                    record[position] = value
+        return Patch(record)
+
+    def int_value(self, param, default=None):
+        value = self.values[PatchParameters.record_index[param]]
+        return default if value == Patch.MISSING[self.values.typecode] else value
+
+    def __getitem__(self, param):
+        value = self.values[PatchParameters.record_index[param]]
+        if value != Patch.MISSING[self.values.typecode]:
+            return str(value)
+        if self.extras and param in self.extras:
+            return self.extras[param]
+        raise KeyError(param)
+
+    def __iter__(self):
+        missing = Patch.MISSING[self.values.typecode]
+        for param, value in zip(PatchParameters.record_params, self.values):
+            if value != missing or (self.extras and param in self.extras):
+                yield param
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Patch({dict(self)})"
+
+
 class PatchParameters:
     def __init__(self, patch_file: Path):
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s %(levelname)s %(message)s",
-            filename="app.log",
-            filemode="w",
-        )
+        # Logging is configured by the application (see patches.py), not per patch
+        self.patch_file = patch_file
 
     @staticmethod
     def get_parameter_values_from_file(filepath: Path):
@@ -19,24 +121,207 @@ class PatchParameters:
         prop_file = open(filepath, "r")
         lines = prop_file.read().split("\n")
         for line in lines:
-            # TODO: step sequence
+            # Step lines are read by get_patch_from_file
             if line and not line.startswith("STEP_"):
-                eqind = line.index("=")
+                eqind = line.find("=")
+                if eqind < 0:
+                    # Malformed; --validate reports it with its line number
+                    logging.warning(f"{filepath}: no '=' in line {line!r}")
+                    continue
                 prop = line[:eqind].strip()
                 val = line[eqind + 1 :].strip()
                 parameter_values[prop] = val
         return parameter_values
 
+    @staticmethod
+    def get_patch_from_file(filepath: Path):
+        # Parameter values and the step sequence, in one pass over the file
+        parameter_values = {}
+        step_values = {}
+        with open(filepath, "r") as prop_file:
+            lines = prop_file.read().split("\n")
+        for line in lines:
+            if not line:
+                continue
+            eqind = line.find("=")
+            if eqind < 0:
+                logging.warning(f"{filepath}: no '=' in line {line!r}")
+                continue
+            prop = line[:eqind].strip()
+            val = line[eqind + 1 :].strip()
+            if not prop.startswith("STEP_"):
+                parameter_values[prop] = val
+                continue
+            step_key = StepSequence.parse_key(prop)
+            if step_key is None:
+                logging.warning(f"{filepath}: unrecognized step key {prop}")
+                continue
+            step, field = step_key
+            try:
+                step_values.setdefault(field, {})[step] = int(val)
+            except ValueError:
+                # --validate reports it with its line number
+                logging.warning(f"{filepath}: {prop} = {val!r} is not an integer")
+        return parameter_values, StepSequence(step_values)
+
+    @staticmethod
+    def get_record_from_bytes(data: bytes):
+        # Values in record_params order, as ints, None where the file doesn't set one.
+        # Step lines and keys outside param_definitions are skipped. Values that aren't ints are
+        # kept as text, with bytes that aren't UTF-8 replaced, so one corrupt file can't stop a bank.
+        record = [None] * len(PatchParameters.record_params)
+        positions = PatchParameters.record_positions
+        for line in data.translate(None, b" \t\r").split(b"\n"):
+            key, _, value = line.partition(b"=")
+            position = positions.get(key)
+            if position is not None:
+                try:
+                    record[position] = int(value)
+                except ValueError:
+                    record[position] = value.decode(errors="replace")
+        return record
+
+    @staticmethod
+    def get_record_from_file(filepath: Path):
+        with open(filepath, "rb") as prop_file:
+            return PatchParameters.get_record_from_bytes(prop_file.read())
+
+    @staticmethod
+    def get_value_matrix(named_values, params=None):
+        # Patches x params int32 matrix, its params (columns) and patch names (rows), from
+        # (patch_name, parameter_values) pairs. Unset or non-numeric values get the DEFAULT.
+        import numpy as np
+
+        params = tuple(params or PatchParameters.record_params)
+        defaults = [PatchParameters.int_defaults[param] for param in params]
+        names = []
+        flat = array("i")
+        for patch_name, parameter_values in named_values:
+            names.append(patch_name)
+            for param, default in zip(params, defaults):
+                try:
+                    flat.append(int(parameter_values.get(param, default)))
+                except (ValueError, OverflowError):
+                    flat.append(default)
+        matrix = np.frombuffer(flat, dtype=np.int32).reshape(len(names), len(params))
+        return matrix, np.array(params), np.array(names)
+
+    @staticmethod
+    def get_value_matrix_from_files(filepaths, params=None, jobs=1, use_threads=False):
+        # get_value_matrix straight from the files' int records, rows named by file stem
+        import numpy as np
+
+        params = tuple(params or PatchParameters.record_params)
+        positions = [PatchParameters.record_index[param] for param in params]
+        defaults = [PatchParameters.int_defaults[param] for param in params]
+        names = []
+        flat = array("i")
+        records = PatchParameters.get_parameter_values_from_files(
+            filepaths, jobs, use_threads, parser=PatchParameters.get_record_from_file
+        )
+        for filepath, record in records:
+            names.append(Path(filepath).stem)
+            for position, default in zip(positions, defaults):
+                value = record[position]
+                try:
+                    flat.append(value if isinstance(value, int) else default)
+                except OverflowError:
+                    flat.append(default)
+        matrix = np.frombuffer(flat, dtype=np.int32).reshape(len(names), len(params))
+        return matrix, np.array(params), np.array(names)
+
+    @staticmethod
+    def get_step_sequence_from_file(filepath: Path):
+        return PatchParameters.get_patch_from_file(filepath)[1]
+
+    @staticmethod
+    def get_parameter_values_from_chunk(filepaths: list[Path], parser=None):
+        parser = parser or PatchParameters.get_parameter_values_from_file
+        return [parser(filepath) for filepath in filepaths]
+
+    @staticmethod
+    def get_parameter_values_from_files(filepaths, jobs=1, use_threads=False, chunksize=32, parser=None):
+        # Yields (filepath, parameter_values) in the order given; parser (default
+        # get_parameter_values_from_file) can be any per-file parser, e.g. get_record_from_file.
+        # With jobs > 1, chunks of files are parsed in a process (or thread) pool. Only a
+        # few chunks per worker are in flight at once, so memory does not grow with the bank.
+        parser = parser or PatchParameters.get_parameter_values_from_file
+        if jobs <= 1:
+            for filepath in filepaths:
+                yield filepath, parser(filepath)
+            return
+
+        def chunks():
+            chunk = []
+            for filepath in filepaths:
+                chunk.append(filepath)
+                if len(chunk) == chunksize:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with executor_class(max_workers=jobs) as executor:
+            pending = deque()
+            for chunk in chunks():
+                pending.append((chunk, executor.submit(PatchParameters.get_parameter_values_from_chunk, chunk, parser)))
+                if len(pending) < jobs * 2:
+                    continue
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+            while pending:
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+
+    # Lookup tables for the SPLIT_TC and CHOP decoders. The signed-byte table is tiny; the
+    # 65536-entry CHOP glyph table is only built the first time a pattern is decoded.
+    SIGNED_BYTES = tuple(byte - 256 if byte & 0x80 else byte for byte in range(256))
+    CHOP_GLYPHS = ("◻︎︎", "◼")
+    chop_patterns: list[str] | None = None
+
     @staticmethod
     def chop_pattern(pattern):
+        # 16 steps, lowest bit first
+        if not 0 <= pattern <= 0xFFFF:
+            return PatchParameters.chop_pattern_slow(pattern)
+        if PatchParameters.chop_patterns is None:
+            byte_glyphs = [
+                "".join(PatchParameters.CHOP_GLYPHS[(byte >> bit) & 1] for bit in range(8)) for byte in range(256)
+            ]
+            PatchParameters.chop_patterns = [low + high for high in byte_glyphs for low in byte_glyphs]
+        return PatchParameters.chop_patterns[pattern]
+
+    @staticmethod
+    def chop_pattern_slow(pattern):
+        # String-based original, kept for values outside 16 bits
         binary_str = format(pattern, "b")
         padded_binary_str = binary_str.zfill(16)
         reversed = padded_binary_str[::-1]
         diagram = re.sub("1", "◼", re.sub("0", "◻︎︎", reversed))
         return diagram
 
+    @staticmethod
+    def chop_pattern_batch(patterns):
+        # Object array of CHOP diagrams for an integer array of 16-bit patterns
+        import numpy as np
+
+        PatchParameters.chop_pattern(0)  # builds the table
+        return np.asarray(PatchParameters.chop_patterns, dtype=object)[np.asarray(patterns, dtype=np.intp)]
+
     @staticmethod
     def integer_to_twos_complement(integer):
+        # The two values are switched in the S-1 e.g., (button2, button1), (button 4, button3),
+        # so the low byte comes first
+        if not 0 <= integer <= 0xFFFF:
+            return PatchParameters.integer_to_twos_complement_slow(integer)
+        return PatchParameters.SIGNED_BYTES[integer & 0xFF], PatchParameters.SIGNED_BYTES[integer >> 8]
+
+    @staticmethod
+    def integer_to_twos_complement_slow(integer):
+        # String-based original, kept for values outside 16 bits
         # Convert the integer to a binary string and remove the '0b' prefix
         binary_str = format(integer, "b")
 
@@ -65,54 +350,127 @@ class PatchParameters:
         return first_decimal, second_decimal
 
     @staticmethod
-    def twos_complement_to_integer(second_decimal, first_decimal):
-        # Define a helper function to convert a signed decimal to an 8-bit binary string
-        def twos_complement_to_binary_string(value):
-            if value < 0:
-                # Calculate the two's complement 8-bit representation of the negative number
-                value = (abs(value) ^ 0xFF) + 1
-            # Convert to binary and extract the last 8 bits (8 characters)
-            return format(value & 0xFF, "08b")
+    def integer_to_twos_complement_batch(integers):
+        # Any-shaped integer array of 16-bit values -> int8 array with a trailing axis of 2,
+        # (low, high) like integer_to_twos_complement. For an (n, 8) block of OSC_DRAW_P1..P8
+        # values, .reshape(n, 16) gives the 16 drawn points of each patch.
+        import numpy as np
 
-        # Convert both integers to 8-bit binary strings
-        first_half = twos_complement_to_binary_string(first_decimal)
-        second_half = twos_complement_to_binary_string(second_decimal)
+        integers = np.asarray(integers).astype(np.uint16)
+        return np.stack([integers & 0xFF, integers >> 8], axis=-1).astype(np.uint8).view(np.int8)
 
-        # Concatenate the two binary strings to form a 16-bit binary string
-        combined_binary = first_half + second_half
+    @staticmethod
+    def twos_complement_to_integer(second_decimal, first_decimal):
+        # Signed bytes back to a 16-bit value, second_decimal in the low byte
+        return ((first_decimal & 0xFF) << 8) | (second_decimal & 0xFF)
 
-        # Convert the 16-bit binary string to an integer
-        result_integer = int(combined_binary, 2)
+    @staticmethod
+    def twos_complement_to_integer_batch(second_decimals, first_decimals):
+        import numpy as np
 
-        return result_integer
+        first = np.asarray(first_decimals).astype(np.int64) & 0xFF
+        second = np.asarray(second_decimals).astype(np.int64) & 0xFF
+        return ((first << 8) | second).astype(np.uint16)
 
     @staticmethod
-    def get_display_value(key, value):
+    def get_display_value(key, value, parameter_values=None):
         # Depends on the property values all being integers. This is true for now, but subject to change.
-        param_def = PatchParameters.param_definitions[key]
+        # Parameters with a DEPENDS entry are decoded by the patch's controlling value when
+        # parameter_values is given; None means the parameter is inactive in this patch.
+        if key in PatchParameters.dependencies and parameter_values is not None:
+            decode = PatchParameters.get_case_decoder(key, parameter_values)
+            return None if decode is None else decode(value)
+        return PatchParameters.decoders[key](value)
+
+    @staticmethod
+    def get_case_decoder(param, parameter_values):
+        # Decoder for param under the patch's controlling value (its DEFAULT if unset); None if inactive
+        controller, cases, controller_default = PatchParameters.dependencies[param]
+        try:
+            case = int(parameter_values.get(controller, controller_default))
+        except ValueError:
+            case = controller_default
+        if case in cases:
+            return cases[case][1]
+        return PatchParameters.decoders[param]
+
+    @staticmethod
+    def get_display_values(parameter_values: dict, params, keep_defaults=False):
+        # Display values of one patch in params order; None where blanked as a default, missing
+        # or inactive. Every raw value is read before any is decoded, so a parameter's controlling
+        # value is there whatever order the file lists them in. A value that isn't an integer is
+        # shown as it is, like patch_display does.
+        display = []
+        for param in params:
+            value = parameter_values.get(param)
+            if value is None:
+                display.append(None)
+                continue
+            try:
+                number = int(value)
+            except ValueError:
+                display.append(value)
+                continue
+            if not keep_defaults and number == PatchParameters.int_defaults[param]:
+                display.append(None)
+            elif param in PatchParameters.dependencies:
+                decode = PatchParameters.get_case_decoder(param, parameter_values)
+                display.append(None if decode is None else decode(value))
+            else:
+                display.append(PatchParameters.decoders[param](value))
+        return display
+
+    @staticmethod
+    def compile_dependencies():
+        # param -> (controlling param, {controlling value: (case definition, decoder)}, its DEFAULT),
+        # from the DEPENDS entries. A case of None makes the parameter inactive (blank) there;
+        # other cases override keys of the parameter's own definition (None removes one).
+        dependencies = {}
+        sorter = graphlib.TopologicalSorter()
+        for param, param_def in PatchParameters.param_definitions.items():
+            sorter.add(param)
+            if "DEPENDS" not in param_def:
+                continue
+            controller = param_def["DEPENDS"]["ON"]
+            sorter.add(param, controller)
+            cases = {}
+            for case, override in param_def["DEPENDS"]["CASES"].items():
+                if override is None:
+                    cases[int(case)] = (None, None)
+                else:
+                    # An override of None removes the key, e.g. the VALUES of a DICT decoded as INT
+                    case_def = {key: value for key, value in {**param_def, **override}.items() if value is not None}
+                    cases[int(case)] = (case_def, PatchParameters.compile_decoder(case_def))
+            controller_default = int(PatchParameters.param_definitions[controller]["DEFAULT"])
+            dependencies[param] = (controller, cases, controller_default)
+        # Cases are chosen by the controlling parameter's raw value, so no decode order is needed,
+        # but a loop of DEPENDS entries is still a mistake in param_definitions: raises CycleError
+        sorter.prepare()
+        return dependencies
+
+    @staticmethod
+    def compile_decoder(param_def):
+        # Resolve the TYPE dispatch once per parameter instead of once per value
         match param_def["TYPE"]:
             case "INT":
-                display_value = value
+                return lambda value: value
             case "DICT":
-                try:
-                    display_value = param_def["VALUES"][value]
-                except KeyError:
-                    # TODO: LFO_RATE depends on LFO_SYNC. Since it could occur before or after, we would need to wait until the end.
-                    display_value = value
+                values = dict(param_def["VALUES"])
+                return lambda value: values.get(value, value)
             case "DIV100":
-                display_value = int(value) / 100
+                return lambda value: int(value) / 100
             case "SPLIT_TC":
-                display_value = PatchParameters.integer_to_twos_complement(int(value))
+                return lambda value: PatchParameters.integer_to_twos_complement(int(value))
             case "CHOP":
-                display_value = PatchParameters.chop_pattern(int(value))
+                return lambda value: PatchParameters.chop_pattern(int(value))
             case "COMB":
                 # Eights, rounded up
-                display_value = math.ceil((int(value) / 8) * 10) / 10
+                return lambda value: math.ceil((int(value) / 8) * 10) / 10
             case "MULT":
-                display_value = round((int(value)+1) / 8, 1)
+                return lambda value: round((int(value) + 1) / 8, 1)
             case _:
-                display_value = f"Type: {param_def["TYPE"]} Value: {value}"
-        return display_value
+                type_name = param_def["TYPE"]
+                return lambda value: f"Type: {type_name} Value: {value}"
 
     param_definitions = {
         "LENG": {
@@ -245,7 +603,7 @@ class PatchParameters:
             "TYPE": "UNK",
             "DEFAULT": "-1",
         },
-        # This depends on LFO_SYNC. How do we represent a RANGE vs a DICT?
+        # Note values when LFO_SYNC is on, a free 0-255 rate when it is off
         "LFO_RATE": {
             "NAME": "LFO Rate",
             "LOCATION": "LFO (RATE)",
@@ -283,6 +641,7 @@ class PatchParameters:
                 "29": "64t",
                 "30": "128",
             },
+            "DEPENDS": {"ON": "LFO_SYNC", "CASES": {"0": {"TYPE": "INT", "RANGE": (0, 255), "VALUES": None}}},
             "DEFAULT": 120,
         },
         "LFO_WAVE_FORM": {
@@ -584,6 +943,7 @@ class PatchParameters:
             "LOCATION": "[DELAY] {tiME}",
             "TYPE": "INT",
             "RANGE": (1, 740),
+            "DEPENDS": {"ON": "TEMPO_SYNC", "CASES": {"1": None}},
             "DEFAULT": "174",
         },
         # Delay Sync (TEMPO_SYNC) = ON
@@ -609,6 +969,7 @@ class PatchParameters:
                 "14": "8d",
                 "15": "1_4",
             },
+            "DEPENDS": {"ON": "TEMPO_SYNC", "CASES": {"0": None}},
             "DEFAULT": "14",
         },
         "DELAY_FEEDBACK": {
@@ -1030,6 +1391,21 @@ class PatchParameters:
         "PRM11": {"NAME": "PRM 11", "LOCATION": "", "TYPE": "UNK", "DEFAULT": "0"},
     }
 
+# Compiled once at import: a decoder per parameter, and defaults as ints for comparisons
+PatchParameters.decoders = {
+    key: PatchParameters.compile_decoder(param_def)
+    for key, param_def in PatchParameters.param_definitions.items()
+}
+PatchParameters.dependencies = PatchParameters.compile_dependencies()
+PatchParameters.int_defaults = {
+    key: int(param_def["DEFAULT"])
+    for key, param_def in PatchParameters.param_definitions.items()
+}
+# Fixed parameter order of the records from get_record_from_file
+PatchParameters.record_params = tuple(PatchParameters.param_definitions)
+PatchParameters.record_positions = {param.encode(): i for i, param in enumerate(PatchParameters.record_params)}
+PatchParameters.record_index = {param: i for i, param in enumerate(PatchParameters.record_params)}
+
 ### Global/Command Menu Options:
 # M.Prb = Master Probability
 # n.Pri = Note Priority
@@ -0,0 +1,101 @@
+"""
+Per-stage timing and allocation instrumentation for patches.py.
+
+Each stage records wall time, CPU time and the number of files it handled.
+With memory tracing on, it also records, through tracemalloc, the bytes and
+blocks it left allocated and its peak traced memory. Tracing slows Python
+code down many times over, so it is a separate opt-in and the times of a
+traced run are not comparable with those of an untraced one. A disabled
+profiler turns every stage into a no-op.
+
+Work of one stage done inside another (the rest of the scan, overlapped with
+parsing) is added to its own stage's record with add_time and taken out of
+the stage it ran in, so no time is counted twice.
+"""
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+
+def _traced_blocks():
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+
+
+class StageProfiler:
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.stages: list[dict] = []
+        self.running: list[dict] = []  # Records of the stages open right now, innermost last
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, files=None):
+        # Yields the stage's record, so a stage can fill in its file count once it knows it
+        record = {"stage": name, "files": files}
+        if not self.enabled:
+            yield record
+            return
+        if self.memory:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            start_blocks = _traced_blocks()
+            tracemalloc.reset_peak()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        self.running.append(record)
+        try:
+            yield record
+        finally:
+            self.running.pop()
+            wall = time.perf_counter() - start_wall - record.pop("lent_wall", 0.0)
+            cpu = time.process_time() - start_cpu - record.pop("lent_cpu", 0.0)
+            record.update({"wall_seconds": wall, "cpu_seconds": cpu})
+            if self.memory:
+                current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                record.update(
+                    {
+                        "allocated_bytes": current_bytes - start_bytes,
+                        "allocated_blocks": _traced_blocks() - start_blocks,
+                        "peak_bytes": peak_bytes,
+                    }
+                )
+            self.stages.append(record)
+
+    def add_time(self, record, wall, cpu, files=None):
+        # Credit a finished stage's record with work done during the stage running now
+        if not self.enabled:
+            return
+        record["wall_seconds"] += wall
+        record["cpu_seconds"] += cpu
+        if files is not None:
+            record["files"] = files
+        if self.running:
+            running = self.running[-1]
+            running["lent_wall"] = running.get("lent_wall", 0.0) + wall
+            running["lent_cpu"] = running.get("lent_cpu", 0.0) + cpu
+
+    def summary(self):
+        return {
+            "stages": self.stages,
+            "total_wall_seconds": sum(stage["wall_seconds"] for stage in self.stages),
+            "total_cpu_seconds": sum(stage["cpu_seconds"] for stage in self.stages),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as profile_file:
+            json.dump(self.summary(), profile_file, indent=1)
+
+    def print_summary(self):
+        print("\n----------------- Profile ---------------")
+        for stage in self.stages:
+            files = "" if stage["files"] is None else f"{stage['files']:8d} files"
+            memory = ""
+            if "peak_bytes" in stage:
+                memory = f" {stage['peak_bytes'] / 2**20:9.1f} MiB peak {stage['allocated_blocks']:+10d} blocks"
+            print(
+                f"{stage['stage']:>10} : {stage['wall_seconds']:9.4f} s wall {stage['cpu_seconds']:9.4f} s cpu"
+                f"{memory} {files}"
+            )
@@ -0,0 +1,156 @@
+"""
+--where queries over a patch bank, answered from per-parameter indexes.
+
+Conditions are PARAM OP VALUE with OP one of = != < <= > >=, compared with
+the raw values in the files; DICT parameters also accept their display
+names (ASSIGN_MODE=Chord). A name that only means something in some cases
+of a DEPENDS entry carries the conditions on the controlling parameter that
+select those cases: LFO_RATE=4d only matches patches with LFO_SYNC on, and
+LFO_RATE!=4d matches every patch that doesn't show 4d, unsynced ones
+included. A query is the AND of its conditions.
+
+Indexes are built from the bank's int matrix, one parameter at a time and
+only when first queried: a value -> bitmap map for DICT parameters, and a
+sorted copy of the column, searched with searchsorted, for the rest.
+Bitmaps are packed bit arrays, so a conjunction is a few bitwise ANDs over
+n/8 bytes rather than a scan of the bank.
+"""
+
+import operator
+import re
+
+import numpy as np
+
+from patch_parameters import PatchParameters as pp
+
+CONDITION = re.compile(r"\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*")
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def display_key(param_def, value):
+    # Raw key of a DICT display name, exact or ignoring case; None if it isn't one
+    if param_def["TYPE"] == "DICT":
+        for key, display in param_def["VALUES"].items():
+            if value == display or value.casefold() == display.casefold():
+                return int(key)
+    return None
+
+
+def resolve_name(param, value):
+    # (raw key, conditions on the controlling parameter under which the name means that key)
+    # for a display name of param; None if it isn't one
+    key = display_key(pp.param_definitions[param], value)
+    if param not in pp.dependencies:
+        return None if key is None else (key, [])
+    controller, cases, _ = pp.dependencies[param]
+    case_keys = {
+        case: None if case_def is None else display_key(case_def, value) for case, (case_def, _) in cases.items()
+    }
+    if key is not None:
+        return key, [(controller, "!=", case) for case, case_key in case_keys.items() if case_key != key]
+    for case, case_key in case_keys.items():
+        if case_key is not None:
+            return case_key, [(controller, "=", case)]
+    return None
+
+
+def parse_condition(text, implied=True):
+    # "VCF_RESONANCE>200" -> ("VCF_RESONANCE", ">", 200); with implied, a display name that only
+    # holds in some cases adds those cases' conditions as a fourth item. ValueError if it isn't one.
+    match = CONDITION.fullmatch(text)
+    if not match:
+        raise ValueError(f"Not a PARAM OP VALUE condition: {text!r}")
+    param, op, value = match.groups()
+    param_def = pp.param_definitions.get(param)
+    if param_def is None:
+        raise ValueError(f"Unknown parameter {param!r} in {text!r}")
+    # Display names before raw keys
+    resolved = resolve_name(param, value)
+    if resolved is not None:
+        key, case = resolved
+        return (param, op, key, tuple(case)) if implied and case else (param, op, key)
+    try:
+        return param, op, int(value)
+    except ValueError:
+        raise ValueError(f"{value!r} is not a value of {param} in {text!r}") from None
+
+
+def parse_conditions(texts, implied=True):
+    # Each --where may hold several conditions separated by commas
+    return [parse_condition(part, implied) for text in texts for part in text.split(",") if part.strip()]
+
+
+class PatchIndex:
+    def __init__(self, matrix, params, patch_names):
+        # matrix: patches x params ints, e.g. from PatchParameters.get_value_matrix_from_files
+        self.matrix = matrix
+        self.columns = {param: i for i, param in enumerate(np.asarray(params).tolist())}
+        self.patch_names = np.asarray(patch_names)
+        self.bitmaps: dict[str, dict[int, np.ndarray]] = {}  # DICT param -> value -> bitmap
+        self.sorted: dict[str, tuple[np.ndarray, np.ndarray]] = {}  # param -> (sorted values, rows)
+
+    def bitmap(self, rows):
+        mask = np.zeros(len(self.patch_names), dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def value_bitmaps(self, param):
+        if param not in self.bitmaps:
+            # DICT parameters have a handful of values, so one pass per value is cheap
+            column = self.matrix[:, self.columns[param]]
+            self.bitmaps[param] = {value: np.packbits(column == value) for value in np.unique(column).tolist()}
+        return self.bitmaps[param]
+
+    def sorted_column(self, param):
+        if param not in self.sorted:
+            column = self.matrix[:, self.columns[param]]
+            rows = np.argsort(column, kind="stable")
+            self.sorted[param] = column[rows], rows
+        return self.sorted[param]
+
+    def match(self, param, op, value, case=()):
+        """Packed bitmap of the patches where param OP value holds. With case, the value is a
+        display name that only means something where all of case's conditions hold: != is then
+        true wherever the name isn't shown, and the other operators only inside the case."""
+        if case:
+            in_case = np.bitwise_and.reduce([self.match(*condition) for condition in case])
+            if op == "!=":
+                return ~(in_case & self.match(param, "=", value))
+            return in_case & self.match(param, op, value)
+        if pp.param_definitions[param]["TYPE"] == "DICT":
+            compare = OPERATORS[op]
+            bitmaps = [bitmap for key, bitmap in self.value_bitmaps(param).items() if compare(key, value)]
+            if not bitmaps:
+                return self.bitmap([])
+            return np.bitwise_or.reduce(bitmaps)
+        values, rows = self.sorted_column(param)
+        left = np.searchsorted(values, value, "left")
+        right = np.searchsorted(values, value, "right")
+        match op:
+            case "=":
+                return self.bitmap(rows[left:right])
+            case "!=":
+                return self.bitmap(np.concatenate([rows[:left], rows[right:]]))
+            case "<":
+                return self.bitmap(rows[:left])
+            case "<=":
+                return self.bitmap(rows[:right])
+            case ">":
+                return self.bitmap(rows[right:])
+            case ">=":
+                return self.bitmap(rows[left:])
+
+    def query(self, conditions):
+        """Names of the patches matching every (param, op, value) condition."""
+        if not conditions:
+            raise ValueError("No conditions to match")
+        bits = np.bitwise_and.reduce([self.match(*condition) for condition in conditions])
+        rows = np.flatnonzero(np.unpackbits(bits, count=len(self.patch_names)))
+        return self.patch_names[rows].tolist()
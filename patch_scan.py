@@ -0,0 +1,54 @@
+"""
+Directory scanning for patch banks.
+
+Built on os.scandir, so file/directory checks come from the cached
+DirEntry type instead of a stat per entry. Scans can recurse into nested
+bank folders, fan out across subdirectories in a thread pool and keep only
+names matching glob patterns. Files are yielded as they are found, so
+parsing can start before the scan is over.
+"""
+
+import fnmatch
+import os
+from pathlib import Path
+
+
+def scan_directory(directory, patterns=()):
+    # (patch files, subdirectories) of one directory; hidden entries are skipped
+    files = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif entry.is_file() and (not patterns or any(fnmatch.fnmatch(entry.name, p) for p in patterns)):
+                files.append(Path(entry.path))
+    return files, subdirectories
+
+
+def scan_patch_files(root, patterns=(), recursive=False, jobs=1):
+    """Yields the patch files under root, in no particular order."""
+    if not recursive:
+        yield from scan_directory(root, patterns)[0]
+        return
+    if jobs <= 1:
+        pending = [root]
+        while pending:
+            files, subdirectories = scan_directory(pending.pop(), patterns)
+            yield from files
+            pending.extend(subdirectories)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    # Each directory is one task; its subdirectories are submitted as soon as it is read
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(scan_directory, root, patterns)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirectories = future.result()
+                pending.update(executor.submit(scan_directory, directory, patterns) for directory in subdirectories)
+                yield from files
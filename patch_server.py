@@ -0,0 +1,326 @@
+"""
+Resident patch library, served as JSON over local HTTP.
+
+A PatchLibrary parses every patch in a directory once and keeps its values
+in memory as compact Patch records, about 600 bytes a patch. Only files
+whose mtime or size changed are parsed again. Changes are picked up through
+inotify when inotify_simple is installed, and by polling otherwise. Queries
+are answered from memory:
+
+    GET /patches                  patch names
+    GET /patch/NAME               raw and display values of one patch
+    GET /diff/A/B                 parameters whose values differ, as display values
+    GET /filter?PARAM=VALUE&...   patches matching every PARAM=VALUE (raw or display value)
+    GET /where?q=COND,COND...     patches matching patches.py --where conditions, from indexes
+    GET /values[?refresh=1]       raw values of every patch by absolute path
+    POST /values                  raw values of a JSON list of absolute paths, for patches.py --server
+    GET /export[?unknown=1&default=1]   the bank as patches.py's CSV
+
+    python patch_server.py --file_dir BANK --port 8765
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from patch_parameters import Patch, PatchParameters as pp
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class PatchLibrary:
+    def __init__(self, file_dir):
+        self.file_dir = Path(file_dir)
+        self.patches: dict[str, tuple] = {}  # stem -> (path, mtime_ns, size, Patch)
+        self.lock = threading.Lock()
+        self.index = None  # PatchIndex for /where, built on first use after a change
+        self.unreadable: dict[str, tuple] = {}  # stem -> (path, mtime_ns, size) of files that failed to parse
+        self.refresh()
+
+    def parse(self, stem, key):
+        # The Patch for a file, or None (logged once per version of the file) if it can't be read
+        try:
+            patch = Patch.from_file(key[0])
+        except (OSError, ValueError) as error:
+            if self.unreadable.get(stem) != key:
+                logging.warning(f"Skipping {key[0]}: {error}")
+            self.unreadable[stem] = key
+            return None
+        self.unreadable.pop(stem, None)
+        return patch
+
+    def refresh(self):
+        # Stat every file; parse only the new or changed ones. Returns (changed, removed) stems.
+        with self.lock:
+            current = {}
+            for entry in os.scandir(self.file_dir):
+                try:
+                    if entry.is_file() and not entry.name.startswith("."):
+                        stat = entry.stat()
+                        current[Path(entry.name).stem] = (os.path.abspath(entry.path), stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    # Removed while scanning
+                    continue
+            changed = [
+                stem
+                for stem, key in current.items()
+                if self.patches.get(stem, (None,) * 3)[:3] != key and self.unreadable.get(stem) != key
+            ]
+            patches = {stem: patch for stem, patch in self.patches.items() if stem in current}
+            for stem in changed:
+                patch = self.parse(stem, current[stem])
+                if patch is None:
+                    patches.pop(stem, None)
+                else:
+                    patches[stem] = (*current[stem], patch)
+            removed = [stem for stem in self.patches if stem not in patches]
+            # Readers always see a whole library, never a half-updated one
+            self.patches = patches
+            if changed or removed:
+                self.index = None
+        if changed or removed:
+            logging.info(f"Library: {len(changed)} added or modified, {len(removed)} removed.")
+        return changed, removed
+
+    def watch(self, interval=2.0):
+        # Refresh whenever the directory changes; runs until the process exits. A failed refresh
+        # is logged and retried, so the library never silently stops following the directory.
+        if INotify is None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    logging.exception(f"Refreshing {self.file_dir} failed")
+            return
+        inotify = INotify()
+        inotify.add_watch(
+            self.file_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        )
+        while True:
+            try:
+                # Wait for a quiet moment, so a burst of writes is one refresh
+                if inotify.read() and not inotify.read(timeout=100):
+                    self.refresh()
+            except Exception:
+                logging.exception(f"Refreshing {self.file_dir} failed")
+                time.sleep(interval)
+
+    def lookup(self, paths):
+        # {path: Patch} for the given absolute paths, each re-stat'ed and parsed again if it
+        # changed. Paths outside the directory, or that can't be read, are left out.
+        file_dir = os.path.abspath(self.file_dir)
+        found = {}
+        with self.lock:
+            patches = dict(self.patches)
+            changed = False
+            for path in paths:
+                if os.path.dirname(path) != file_dir:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                stem = Path(path).stem
+                key = (path, stat.st_mtime_ns, stat.st_size)
+                if patches.get(stem, (None,) * 3)[:3] != key:
+                    patch = None if self.unreadable.get(stem) == key else self.parse(stem, key)
+                    if patch is None:
+                        continue
+                    patches[stem] = (*key, patch)
+                    changed = True
+                found[path] = patches[stem][3]
+            if changed:
+                self.patches = patches
+                self.index = None
+        return found
+
+    def names(self):
+        return sorted(self.patches)
+
+    def values(self, name):
+        return self.patches[name][3]
+
+    def display(self, name):
+        parameter_values = self.values(name)
+        params = [param for param in pp.param_definitions if param in parameter_values]
+        return dict(zip(params, pp.get_display_values(parameter_values, params, keep_defaults=True)))
+
+    def diff(self, name_a, name_b):
+        values_a, values_b = self.values(name_a), self.values(name_b)
+        return {
+            param: [
+                self.display_value(param, values_a.get(param), values_a),
+                self.display_value(param, values_b.get(param), values_b),
+            ]
+            for param in sorted(values_a.keys() | values_b.keys())
+            if values_a.get(param) != values_b.get(param)
+        }
+
+    @staticmethod
+    def display_value(param, value, parameter_values=None):
+        if value is None or param not in pp.param_definitions:
+            return value
+        return pp.get_display_value(param, value, parameter_values)
+
+    def filter(self, conditions: dict):
+        # A condition matches the raw value ("16") or the display value ("SAW")
+        def matches(parameter_values, param, wanted):
+            value = parameter_values.get(param)
+            return value is not None and wanted in (value, str(self.display_value(param, value, parameter_values)))
+
+        patches = self.patches
+        return sorted(
+            name
+            for name, (*_, parameter_values) in patches.items()
+            if all(matches(parameter_values, param, wanted) for param, wanted in conditions.items())
+        )
+
+    def where(self, conditions):
+        from patch_query import PatchIndex
+
+        index = self.index
+        if index is None:
+            patches = self.patches
+            matrix, params, names = pp.get_value_matrix((name, patches[name][3]) for name in sorted(patches))
+            index = self.index = PatchIndex(matrix, params, names)
+        return index.query(conditions)
+
+    def export_csv(self, unknown=False, keep_defaults=False):
+        # The layout of patches.py's CSV (without step sequences, which are not kept in memory)
+        params = [param for param, param_def in pp.param_definitions.items() if unknown or param_def["TYPE"] != "UNK"]
+        patches = self.patches
+        names = sorted(patches)
+        columns = [pp.get_display_values(patches[name][3], params, keep_defaults) for name in names]
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["NAME", "LOCATION", "DEFAULT", *names])
+        for row, param in enumerate(params):
+            param_def = pp.param_definitions[param]
+            default = pp.get_display_value(param, param_def["DEFAULT"])
+            writer.writerow([param_def["NAME"], param_def["LOCATION"], default, *(column[row] for column in columns)])
+        return out.getvalue()
+
+
+class PatchRequestHandler(BaseHTTPRequestHandler):
+    library: PatchLibrary = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.split("/") if part]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        library = self.library
+        try:
+            match parts:
+                case ["patches"]:
+                    self.send_json(library.names())
+                case ["patch", name]:
+                    values = dict(library.values(name))
+                    self.send_json({"name": name, "values": values, "display": library.display(name)})
+                case ["diff", name_a, name_b]:
+                    self.send_json(library.diff(name_a, name_b))
+                case ["filter"]:
+                    self.send_json(library.filter(query))
+                case ["where"]:
+                    from patch_query import parse_conditions
+
+                    try:
+                        self.send_json(library.where(parse_conditions([query.get("q", "")])))
+                    except ValueError as error:
+                        self.send_error(400, str(error))
+                case ["values"]:
+                    if query.get("refresh"):
+                        library.refresh()
+                    self.send_json({patch[0]: dict(patch[3]) for patch in library.patches.values()})
+                case ["export"]:
+                    text = library.export_csv(bool(query.get("unknown")), bool(query.get("default")))
+                    self.send_body(text.encode(), "text/csv")
+                case _:
+                    self.send_error(404, f"Unknown query {url.path}")
+        except KeyError as error:
+            self.send_error(404, f"No patch named {error}")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.strip("/") != "values":
+            self.send_error(404, f"Unknown query {url.path}")
+            return
+        try:
+            paths = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            paths = None
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            self.send_error(400, "Expected a JSON list of paths")
+            return
+        self.send_json({path: dict(patch) for path, patch in self.library.lookup(paths).items()})
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode(), "application/json")
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def serve(file_dir, host="127.0.0.1", port=8765, interval=2.0):
+    library = PatchLibrary(file_dir)
+    print(f"{len(library.patches)} patches from {file_dir}, serving on http://{host}:{port}/")
+    threading.Thread(target=library.watch, args=(interval,), daemon=True).start()
+    handler = type("Handler", (PatchRequestHandler,), {"library": library})
+    with ThreadingHTTPServer((host, port), handler) as server:
+        server.serve_forever()
+
+
+def get_parameter_values_from_server(server_url, filepaths):
+    # Same contract as PatchParameters.get_parameter_values_from_files, answered by a running
+    # server for just these files. Files it doesn't know (outside its directory) are parsed here.
+    filepaths = list(filepaths)
+    body = json.dumps([os.path.abspath(filepath) for filepath in filepaths]).encode()
+    request = urllib.request.Request(
+        f"{server_url.rstrip('/')}/values", data=body, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        library = json.load(response)
+    for filepath in filepaths:
+        parameter_values = library.get(os.path.abspath(filepath))
+        if parameter_values is None:
+            parameter_values = pp.get_parameter_values_from_file(filepath)
+        yield filepath, parameter_values
+
+
+def parse_server_args(raw_args):
+    parser = argparse.ArgumentParser(description="Serve a patch bank from memory over local HTTP")
+    parser.add_argument("--file_dir", "-d", help="Directory of .PRM files to serve", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--interval",
+        help="Seconds between directory polls when inotify_simple is not installed",
+        type=float,
+        default=2.0,
+    )
+    return parser.parse_args(raw_args)
+
+
+if __name__ == "__main__":
+    server_args = parse_server_args(sys.argv[1:])
+    serve(server_args.file_dir, server_args.host, server_args.port, server_args.interval)
@@ -0,0 +1,178 @@
+"""
+"Sounds like" search over a patch bank.
+
+Each patch becomes a feature vector built from param_definitions: RANGE
+parameters are scaled to 0..1, DICT parameters are one-hot encoded,
+SPLIT_TC pads are split into their two signed bytes and CHOP patterns into
+their 16 steps. UNK parameters are left out. A parameter with a DEPENDS
+entry is encoded by the definition of each patch's case (LFO_RATE as a
+note when synced, as a 0-255 rate when not), and has all-zero features
+where it is inactive. The index is built from an
+int matrix (PatchParameters.get_value_matrix_from_files), or from a
+values_df through raw_matrix. Neighbours are found by
+Euclidean distance, either by brute force over the whole matrix (batched
+dot products) or among the candidates of a random-projection LSH index.
+"""
+
+import numpy as np
+import pandas as pd
+
+from patch_parameters import PatchParameters as pp
+
+
+def raw_matrix(values_df: pd.DataFrame, params) -> np.ndarray:
+    # Patches x params int64 matrix from a params x patches frame of raw strings.
+    # Missing or non-numeric values fall back to the DEFAULT.
+    rows = values_df.index.get_indexer(params)
+    values = values_df.to_numpy(object)[rows]
+    values[rows == -1] = np.nan
+    try:
+        numbers = values.astype(np.float64)
+    except ValueError:
+        numbers = pd.to_numeric(values.ravel(), errors="coerce").reshape(values.shape)
+    defaults = np.array([pp.int_defaults[param] for param in params], dtype=np.float64)
+    numbers = np.where(np.isnan(numbers), defaults[:, None], numbers)
+    return numbers.T.astype(np.int64)
+
+
+def feature_params():
+    return [param for param, param_def in pp.param_definitions.items() if param_def["TYPE"] != "UNK"]
+
+
+def feature_matrix(values_df: pd.DataFrame):
+    """Patches x features float32 matrix and the feature names."""
+    params = feature_params()
+    return features_from_raw(raw_matrix(values_df, params), params)
+
+
+def param_features(param, param_def, values):
+    # (columns, names) of one parameter read with one definition
+    columns = []
+    names = []
+    match param_def["TYPE"]:
+        case "DICT":
+            for key in param_def["VALUES"]:
+                columns.append(values == int(key))
+                names.append(f"{param}={key}")
+        case "SPLIT_TC":
+            # Two signed bytes, low byte first as in integer_to_twos_complement
+            signed = pp.integer_to_twos_complement_batch(values)
+            for half in (0, 1):
+                columns.append((signed[:, half].astype(np.float64) + 128) / 255)
+                names.append(f"{param}.{half + 1}")
+        case "CHOP":
+            for bit in range(16):
+                columns.append((values >> bit) & 1)
+                names.append(f"{param}.{bit + 1}")
+        case _:
+            lo, hi = param_def["RANGE"]
+            columns.append(np.clip((values - lo) / (hi - lo), 0, 1))
+            names.append(param)
+    return columns, names
+
+
+def dependent_features(param, values, controls):
+    # The features of each case's definition, zero in the patches of other cases
+    _, cases, _ = pp.dependencies[param]
+    columns = []
+    names = []
+    other = ~np.isin(controls, list(cases))
+    for case_def, rows in [(pp.param_definitions[param], other)] + [
+        (case_def, controls == case) for case, (case_def, _) in cases.items()
+    ]:
+        if case_def is None:
+            # Inactive in these patches
+            continue
+        case_columns, case_names = param_features(param, case_def, values)
+        columns.extend(np.where(rows, column, 0) for column in case_columns)
+        names.extend(case_names)
+    return columns, names
+
+
+def features_from_raw(raw: np.ndarray, params):
+    # raw: patches x params ints, e.g. from PatchParameters.get_value_matrix_from_files
+    columns = []
+    names = []
+    positions = {param: i for i, param in enumerate(params)}
+    for i, param in enumerate(params):
+        values = raw[:, i]
+        if param in pp.dependencies:
+            controller, _, controller_default = pp.dependencies[param]
+            if controller in positions:
+                controls = raw[:, positions[controller]]
+            else:
+                controls = np.full(len(raw), controller_default)
+            param_columns, param_names = dependent_features(param, values, controls)
+        else:
+            param_columns, param_names = param_features(param, pp.param_definitions[param], values)
+        columns.extend(param_columns)
+        names.extend(param_names)
+    return np.column_stack(columns).astype(np.float32), names
+
+
+class SimilarityIndex:
+    def __init__(self, raw: np.ndarray, patch_names, lsh_bits=0, lsh_tables=4, seed=0):
+        # raw: patches x feature_params() int matrix, one row per name in patch_names
+        self.patch_names = list(patch_names)
+        self.positions = {name: i for i, name in enumerate(self.patch_names)}
+        self.features, self.feature_names = features_from_raw(raw, feature_params())
+        self.norms = np.einsum("ij,ij->i", self.features, self.features)
+        self.lsh_bits = lsh_bits
+        self.tables = []
+        if lsh_bits:
+            rng = np.random.default_rng(seed)
+            self.center = self.features.mean(axis=0)
+            weights = 1 << np.arange(lsh_bits, dtype=np.int64)
+            for _ in range(lsh_tables):
+                planes = rng.standard_normal((self.features.shape[1], lsh_bits)).astype(np.float32)
+                signatures = (((self.features - self.center) @ planes) > 0) @ weights
+                buckets = {}
+                for i, signature in enumerate(signatures.tolist()):
+                    buckets.setdefault(signature, []).append(i)
+                self.tables.append((planes, weights, buckets))
+
+    def distances(self, vector, rows=None, batch_size=65536):
+        # Squared Euclidean distance via |a|^2 + |b|^2 - 2a.b, in batches to bound memory
+        if rows is not None:
+            features, norms = self.features[rows], self.norms[rows]
+        else:
+            features, norms = self.features, self.norms
+        result = np.empty(len(features), dtype=np.float32)
+        vector_norm = vector @ vector
+        for start in range(0, len(features), batch_size):
+            stop = start + batch_size
+            result[start:stop] = norms[start:stop] + vector_norm - 2 * (features[start:stop] @ vector)
+        return np.maximum(result, 0)
+
+    def candidates(self, vector):
+        # Rows sharing an LSH bucket, probing signatures one bit away as well
+        rows = set()
+        for planes, weights, buckets in self.tables:
+            signature = int((((vector - self.center) @ planes) > 0) @ weights)
+            rows.update(buckets.get(signature, ()))
+            for bit in range(self.lsh_bits):
+                rows.update(buckets.get(signature ^ (1 << bit), ()))
+        return np.fromiter(rows, dtype=np.intp, count=len(rows))
+
+    def query(self, patch_name, k=10):
+        """The k patches closest to patch_name, as (patch_name, distance), nearest first."""
+        position = self.positions[patch_name]
+        vector = self.features[position]
+        rows = None
+        if self.tables:
+            rows = self.candidates(vector)
+            if len(rows) <= k:
+                # Too few candidates to fill the answer; fall back to brute force
+                rows = None
+        distances = self.distances(vector, rows)
+        if rows is None:
+            rows = np.arange(len(self.patch_names))
+        # k + 1 because the patch itself is at distance 0
+        count = min(k + 1, len(rows))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [
+            (self.patch_names[rows[i]], float(np.sqrt(distances[i])))
+            for i in nearest
+            if rows[i] != position
+        ][:k]
@@ -0,0 +1,136 @@
+"""
+Checks patch files against param_definitions.
+
+Each file is read once, on its own, and anything wrong with its lines is
+noted: malformed lines, unknown keys, repeated keys and values that are
+not integers. Step values are checked there too, against
+StepSequence.RANGES for the fields it knows. A file that can't be read at
+all is reported and skipped.
+The values of the whole bank then go into one int matrix, and RANGE and
+VALUES are checked column by column with vectorized comparisons. A
+parameter with a DEPENDS entry is checked against each patch's case.
+Every problem is reported with its file and line.
+"""
+
+import numpy as np
+
+from patch_parameters import PatchParameters as pp, StepSequence
+
+LIMIT = 2**62
+
+
+def scan_file(filepath):
+    # (record of ints or None, line number of each param, [(line, message)]) for one file
+    record = [None] * len(pp.record_params)
+    lines = {}
+    problems = []
+    try:
+        with open(filepath, "r") as prop_file:
+            text = prop_file.read()
+    except (OSError, UnicodeDecodeError) as error:
+        return record, lines, [(0, f"unreadable: {error}")]
+    for number, line in enumerate(text.split("\n"), 1):
+        if not line.strip():
+            continue
+        key, sep, value = line.partition("=")
+        key = key.strip()
+        value = value.strip()
+        if not sep:
+            problems.append((number, f"malformed line (no '='): {line.strip()!r}"))
+            continue
+        if key.startswith("STEP_"):
+            step_key = StepSequence.parse_key(key)
+            if step_key is None:
+                problems.append((number, f"unrecognized step key {key}"))
+                continue
+            try:
+                step_value = int(value)
+            except ValueError:
+                problems.append((number, f"{key} = {value!r} is not an integer"))
+                continue
+            lo, hi = StepSequence.RANGES.get(step_key[1], (step_value, step_value))
+            if not lo <= step_value <= hi:
+                problems.append((number, f"{key} = {step_value} is out of range, expected in {lo}..{hi}"))
+            continue
+        position = pp.record_index.get(key)
+        if position is None:
+            problems.append((number, f"unknown parameter {key}"))
+            continue
+        if key in lines:
+            problems.append((number, f"{key} repeated (first on line {lines[key]})"))
+        lines[key] = number
+        try:
+            record[position] = int(value)
+        except ValueError:
+            problems.append((number, f"{key} = {value!r} is not an integer"))
+    return record, lines, problems
+
+
+def out_of_range(param_def, values):
+    # Mask of the values param_def doesn't allow; all False when it declares no RANGE or VALUES
+    if "VALUES" in param_def:
+        return ~np.isin(values, [int(key) for key in param_def["VALUES"]])
+    if "RANGE" in param_def:
+        lo, hi = param_def["RANGE"]
+        return (values < lo) | (values > hi)
+    return np.zeros(len(values), dtype=bool)
+
+
+def allowed(param_def):
+    if "VALUES" in param_def:
+        return f"one of {', '.join(param_def['VALUES'])}"
+    if "RANGE" in param_def:
+        return f"in {param_def['RANGE'][0]}..{param_def['RANGE'][1]}"
+    return "any value"
+
+
+def validate_files(filepaths, jobs=1, use_threads=False):
+    """[(filepath, line, message)] for every problem found, in file order."""
+    scanned = list(pp.get_parameter_values_from_files(filepaths, jobs, use_threads, parser=scan_file))
+    problems = [(filepath, line, message) for filepath, (_, _, found) in scanned for line, message in found]
+    if not scanned:
+        return problems
+
+    # Unset values are held at the DEFAULT and masked out; huge ones are clipped to stay out of range
+    params = pp.record_params
+    defaults = [pp.int_defaults[param] for param in params]
+    records = [record for _, (record, _, _) in scanned]
+    present = np.array([[value is not None for value in record] for record in records], dtype=bool)
+    matrix = np.array(
+        [
+            [default if value is None else max(min(value, LIMIT), -LIMIT) for value, default in zip(record, defaults)]
+            for record in records
+        ],
+        dtype=np.int64,
+    )
+
+    bad = np.zeros(matrix.shape, dtype=bool)
+    cases = {}  # (row, column) -> the case definition a DEPENDS parameter was checked against
+    for column, param in enumerate(params):
+        param_def = pp.param_definitions[param]
+        if param not in pp.dependencies:
+            bad[:, column] = out_of_range(param_def, matrix[:, column])
+            continue
+        controller, case_defs, _ = pp.dependencies[param]
+        controls = matrix[:, pp.record_index[controller]]
+        for case in np.unique(controls).tolist():
+            case_def = case_defs[case][0] if case in case_defs else param_def
+            if case_def is None:
+                # Inactive: any stored value is harmless
+                continue
+            rows = np.flatnonzero(controls == case)
+            bad[rows, column] = out_of_range(case_def, matrix[rows, column])
+            for row in rows[bad[rows, column]].tolist():
+                cases[row, column] = case_def
+    bad &= present
+
+    for row, column in zip(*np.nonzero(bad)):
+        filepath, (_, lines, _) = scanned[row]
+        param = params[column]
+        param_def = cases.get((row, column), pp.param_definitions[param])
+        problems.append(
+            (filepath, lines[param], f"{param} = {matrix[row, column]} is out of range, expected {allowed(param_def)}")
+        )
+    order = {filepath: i for i, (filepath, _) in enumerate(scanned)}
+    problems.sort(key=lambda problem: (order[problem[0]], problem[1]))
+    return problems
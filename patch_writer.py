@@ -0,0 +1,179 @@
+"""
+Writes edited parameter values back to .PRM files.
+
+Each file is rewritten from its original: lines keep their order, spacing
+and line endings, only the values of edited keys change, and STEP_ lines
+are copied as they are. Keys the file doesn't have yet go before its step
+lines. The new text is written to a temporary file in the same directory
+in one buffered write, then renamed over the target, so a reader never
+sees a half-written patch.
+
+Edits are raw values (what the files hold, not display values), keyed by
+parameter, from any mapping: a dict, a Patch record, a values_df column or
+a row of an edits CSV (PATCH column, then one column per parameter; blank
+cells are left unchanged). Every edit is checked against param_definitions
+before anything is written: unknown keys, values that aren't integers and
+values outside RANGE or VALUES are refused, so a written patch is valid.
+"""
+
+import csv
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from patch_parameters import PatchParameters as pp
+from patch_validate import allowed, out_of_range
+
+
+def edit_text(text, edits):
+    # The file's text with the values of edited keys replaced, every occurrence of a repeated
+    # key included (parsers keep the last); missing keys are inserted
+    lines = text.split("\n")
+    remaining = dict(edits)
+    found = set()
+    separator = "\t= "
+    insert_at = None
+    for i, line in enumerate(lines):
+        if "=" not in line:
+            continue
+        eqind = line.index("=")
+        key = line[:eqind].strip()
+        if key.startswith("STEP_"):
+            if insert_at is None:
+                insert_at = i
+            continue
+        rest = line[eqind + 1 :]
+        lead = rest[: len(rest) - len(rest.lstrip())]
+        trail = rest[len(rest.rstrip()) :]
+        separator = line[len(line[:eqind].rstrip()) : eqind + 1] + lead
+        if key in remaining:
+            lines[i] = f"{line[:eqind + 1]}{lead}{remaining[key]}{trail}"
+            found.add(key)
+    remaining = {key: value for key, value in remaining.items() if key not in found}
+    if remaining:
+        if insert_at is None:
+            # Before the trailing empty string of a file ending in a newline
+            insert_at = len(lines) - 1 if lines and not lines[-1] else len(lines)
+        ending = "\r" if lines and lines[0].endswith("\r") else ""
+        lines[insert_at:insert_at] = [f"{key}{separator}{value}{ending}" for key, value in remaining.items()]
+    return "\n".join(lines)
+
+
+def write_atomic(path: Path, text, mode_from=None):
+    # Temporary file in the target's directory, then an atomic rename over the target
+    path = Path(path)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=f".{path.name}.", delete=False, newline="") as tmp:
+        tmp.write(text)
+    try:
+        if mode_from is not None:
+            shutil.copymode(mode_from, tmp.name)
+        os.replace(tmp.name, path)
+    except OSError:
+        os.unlink(tmp.name)
+        raise
+
+
+def write_patch(source: Path, edits, target: Path = None):
+    """Write source with edits applied to target (default: over source itself)."""
+    with open(source, "r", newline="") as prop_file:
+        text = prop_file.read()
+    edits = {param: str(value) for param, value in edits.items() if value is not None}
+    target = Path(target or source)
+    write_atomic(target, edit_text(text, edits), mode_from=source)
+    return target
+
+
+def edit_problems(source, edits):
+    """Messages for the edits param_definitions doesn't allow; a parameter with a DEPENDS entry
+    is checked against the case its controlling value (edited, or else the file's) selects."""
+    problems = []
+    file_values = None
+    for param, value in edits.items():
+        param_def = pp.param_definitions.get(param)
+        if param_def is None:
+            problems.append(f"{source}: unknown parameter {param}")
+            continue
+        try:
+            number = int(value)
+        except ValueError:
+            problems.append(f"{source}: {param} = {value!r} is not an integer")
+            continue
+        if param in pp.dependencies:
+            controller, cases, controller_default = pp.dependencies[param]
+            if controller not in edits and file_values is None:
+                file_values = pp.get_parameter_values_from_file(source)
+            control = edits[controller] if controller in edits else (file_values or {}).get(controller)
+            try:
+                case = int(control) if control is not None else controller_default
+            except ValueError:
+                case = controller_default
+            if case in cases:
+                param_def = cases[case][0]
+                if param_def is None:
+                    # Inactive in this patch: any value is harmless
+                    continue
+        if out_of_range(param_def, np.array([number]))[0]:
+            problems.append(f"{source}: {param} = {number} is out of range, expected {allowed(param_def)}")
+    return problems
+
+
+def prepare_edits(edited):
+    """[(source path, edited text)] for (source path, edits) pairs. Every source is read and every
+    edit checked before anything is written; raises ValueError listing each invalid edit or
+    unreadable file if there is one."""
+    prepared = []
+    problems = []
+    for source, edits in edited:
+        edits = {param: str(value) for param, value in edits.items() if value is not None}
+        try:
+            with open(source, "r", newline="") as prop_file:
+                text = prop_file.read()
+        except (OSError, UnicodeDecodeError) as error:
+            problems.append(f"{source}: unreadable: {error}")
+            continue
+        found = edit_problems(source, edits)
+        if found:
+            problems.extend(found)
+            continue
+        prepared.append((source, edit_text(text, edits)))
+    if problems:
+        raise ValueError("\n".join(problems))
+    return prepared
+
+
+def write_prepared(prepared, out_dir=None):
+    # Yields each target once its text is in place; with out_dir, edited copies go there instead
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for source, text in prepared:
+        target = Path(out_dir, Path(source).name) if out_dir is not None else Path(source)
+        write_atomic(target, text, mode_from=source)
+        yield target
+
+
+def write_patches(edited, out_dir=None):
+    """Apply (source path, edits) pairs; with out_dir, edited copies go there instead. Returns the count.
+    Raises ValueError, before any file is written, if an edit is invalid or a source unreadable."""
+    return sum(1 for _ in write_prepared(prepare_edits(edited), out_dir))
+
+
+def edits_from_csv(csvname):
+    """{patch name: {param: raw value}} from a CSV with a PATCH column and one column per parameter."""
+    with open(csvname, newline="") as csv_file:
+        return {
+            row.pop("PATCH"): {param: value for param, value in row.items() if value != ""}
+            for row in csv.DictReader(csv_file)
+        }
+
+
+def edits_from_frame(values_df):
+    """{patch name: {param: raw value}} from a parameters x patches frame like App.values_df."""
+    import pandas as pd
+
+    return {
+        patch_name: {param: value for param, value in column.items() if not pd.isna(value)}
+        for patch_name, column in values_df.items()
+    }
@@ -6,76 +6,181 @@ basic organization, arguments, etc.
 # import os
 import sys
 import argparse
+import csv
+import itertools
+import json
 import logging
+import os
+import time
 from pathlib import Path
-import pandas as pd
 from patch_parameters import PatchParameters as pp
+from patch_profile import StageProfiler
+from patch_scan import scan_patch_files
+
+# pandas, NumPy and the modules built on them are imported where they are needed, so
+# small runs (a few patches, CSV out) start without them.
+EXPORT_FORMATS = ("csv", "parquet", "arrow", "npy")
+# Banks up to this many patches skip pandas and are tabulated in plain Python
+SMALL_BANK = 200
 
 
 class App:
     def __init__(self, app_args):
         self.args = app_args
         self.patch_dir = self.args.file_dir
-        self.patch_files: list[Path] = []
-        import pandas as pd
-        self.values_df = pd.DataFrame()  # Raw values
-        self.display_df = pd.DataFrame()  # Readable values
-        self.param_attributes = (
-            pd.DataFrame()
-        )  # Full name, location on device, data type, default value
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s %(levelname)s %(message)s",
-            filename="app.log",
-            filemode="w",
-        )
+        self.patch_files: list[Path] = []  # Found so far; complete once the scanner is exhausted
+        self.scanner = iter(())
+        self.scan_stage = {}  # The scan's profile record, completed as the rest of the scan is read
+        self.cache = None
+        self.status = 0  # Exit status
+        self.profiler = StageProfiler(enabled=bool(self.args.profile), memory=self.args.profile_memory)
+        self.step_texts: dict[str, str] = {}  # Patch name -> step text, kept from parsing until output
+        self.values_df = None  # Raw values (DataFrame)
+        self.display_df = None  # Readable values (DataFrame)
+        self.param_attributes = None  # Full name, location on device, data type, default value
+        # Off unless asked for; the file is appended to, not rewritten on every run
+        if self.args.log:
+            logging.basicConfig(
+                level=logging.DEBUG if self.args.verbose else logging.INFO,
+                format="%(asctime)s %(levelname)s %(message)s",
+                filename=self.args.log,
+                filemode="a",
+            )
         # logging.debug('A debug message')
 
     def execute(self):
         print("Executing.")
+        profile = None
+        if self.args.pstats:
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
         self.prepare()
         self.run()
         self.cleanup()
-        return 0
+        if profile:
+            profile.disable()
+            profile.dump_stats(self.args.pstats)
+        if self.args.profile:
+            self.profiler.print_summary()
+            self.profiler.write_json(self.args.profile)
+        return self.status
 
     def prepare(self):
         print(f"Preparing {self.args.app_name}.")
-        if self.args.patch_file:
-            self.patch_files = [Path(self.patch_dir, file) for file in self.args.patch_file]
-        else:
-            self.patch_files = [
-                patch_file
-                for patch_file in Path(self.patch_dir).iterdir()
-                if patch_file.is_file() and not patch_file.name.startswith(".")
-            ]
+        with self.profiler.stage("scan") as self.scan_stage:
+            if self.args.diff:
+                # --diff reads only the patches or banks it is given
+                self.scanner = iter(())
+            elif self.args.patch_file:
+                self.scanner = iter([Path(self.patch_dir, file) for file in self.args.patch_file])
+            else:
+                self.scanner = scan_patch_files(self.patch_dir, self.args.glob or (), self.args.recursive, self.args.jobs)
+            # Just enough to tell a small bank from a big one; the rest is found while parsing
+            self.patch_files = list(itertools.islice(self.scanner, SMALL_BANK + 1))
+            self.scan_stage["files"] = len(self.patch_files)
+        if self.args.cache:
+            from patch_cache import PatchCache
+
+            self.cache = PatchCache(self.args.cache, self.args.cache_hash)
+
+    def finish_scan(self):
+        for _ in self.discovered_files():
+            pass
+
+    def discovered_files(self):
+        # The files found so far, then the rest of the scan as it goes, so parsing overlaps scanning.
+        # Time spent waiting on the scan is counted in the scan stage, not the stage consuming it.
+        yield from list(self.patch_files)
+        wall = cpu = 0.0
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            patch_file = next(self.scanner, None)
+            wall += time.perf_counter() - start_wall
+            cpu += time.process_time() - start_cpu
+            if patch_file is None:
+                break
+            self.patch_files.append(patch_file)
+            yield patch_file
+        self.profiler.add_time(self.scan_stage, wall, cpu, len(self.patch_files))
 
     def run(self):
         logging.info(f"Running {self.args.app_name}.")
+        if self.args.stream or self.args.dedupe or self.args.incremental:
+            # These need the whole file list up front
+            self.finish_scan()
+        if self.args.stream:
+            with self.profiler.stage("stream", len(self.patch_files)):
+                self.stream_to_csv()
+            return
+        if self.args.similar:
+            self.find_similar()
+            return
+        if self.args.diff:
+            self.diff()
+            return
+        if self.args.validate:
+            with self.profiler.stage("validate"):
+                self.validate()
+            return
+        if self.args.set or self.args.apply:
+            self.edit_patches()
+            return
+        if self.args.where:
+            self.find_where()
+            return
+        if self.args.dedupe:
+            with self.profiler.stage("dedupe", len(self.patch_files)):
+                self.find_duplicates()
+            return
+        if self.args.incremental:
+            with self.profiler.stage("incremental"):
+                done = self.incremental_to_csv()
+            if done:
+                return
 
-        # helper for getting descriptive names and blanking out defaults
-        def display_value(value, param):
-            default = self.param_attributes["DEFAULT"][param]
-            if int(value) == int(default) and not self.args.default:
-                return pd.NA
-            return pp.get_display_value(param, value)
+        if self.is_small_bank():
+            with self.profiler.stage("table", len(self.patch_files)):
+                self.table_to_csv()
+            return
+
+        self.load_values()
+        self.build_display()
+
+        # Output
+        with self.profiler.stage("dump", len(self.patch_files)):
+            self.dump()
+        with self.profiler.stage("csv", len(self.patch_files)):
+            self.dump_to_csv()
+        if self.args.format != "csv":
+            import patch_export
+
+            with self.profiler.stage("export", len(self.patch_files)):
+                path = patch_export.export(self.values_df, self.output_params(), self.args.csvname, self.args.format)
+            logging.info(f"Wrote {path}")
+        if self.args.incremental:
+            self.save_manifest()
+
+    def is_small_bank(self):
+        # Plain CSV output of a few patches doesn't need pandas
+        return len(self.patch_files) <= SMALL_BANK and self.args.format == "csv" and not self.args.incremental
+
+    def build_display(self):
+        import pandas as pd
+        import patch_display
 
-        # DF: rows = params, cols = files
-        self.values_df = pd.DataFrame(
-            {
-                patch_file.stem: pp.get_parameter_values_from_file(patch_file)
-                for patch_file in self.patch_files
-            }
-        )
         # display_value = pp.get_display_value(prop, val)
         self.param_attributes = pd.DataFrame(pp.param_definitions).transpose()
-        self.values_df.sort_index(axis=1, inplace=True)
-        self.values_df.sort_index(axis=0, inplace=True)
 
-        # Make cell values human-readable
-        display_rows = {}
-        for row in self.values_df.iterrows():
-            display_rows[row[0]] = row[1].apply(display_value, args=(row[0],))
-            self.display_df = pd.DataFrame(display_rows)
+        # Make cell values human-readable, blanking out defaults
+        with self.profiler.stage("display", len(self.values_df.columns)):
+            self.display_df = patch_display.display_frame(self.values_df, self.args.default)
+        with self.profiler.stage("concat", len(self.values_df.columns)):
+            self.add_attributes()
+
+    def add_attributes(self):
+        import pandas as pd
 
         # Human-readable defaults for CSV
         display_defaults = {}
@@ -91,7 +196,7 @@ class App:
                 self.param_attributes["LOCATION"],
                 self.param_attributes["TYPE"],
                 display_defaults,
-                self.display_df.T,
+                self.display_df,
             ],
             axis=1,
         )
@@ -103,11 +208,188 @@ class App:
                 self.display_df[self.display_df["TYPE"] == "UNK"].index, inplace=True
             )
 
-        # Output
-        self.dump()
-        self.dump_to_csv()
+        # Step sequences, one compact cell per patch
+        if self.args.steps:
+            self.display_df.loc["STEPS"] = pd.Series(
+                {
+                    "NAME": "Step Sequence",
+                    "LOCATION": "[STEP]",
+                    "TYPE": "STEPS",
+                    "DEFAULT": pd.NA,
+                    **{patch_file.stem: self.step_text(patch_file) for patch_file in self.patch_files},
+                }
+            )
+
+    def load_values(self):
+        import pandas as pd
+
+        with self.profiler.stage("parse") as stage:
+            parsed = list(self.read_patch_files(self.discovered_files()))
+            stage["files"] = len(parsed)
+        # DF: rows = params, cols = files
+        with self.profiler.stage("frame", len(parsed)):
+            self.values_df = pd.DataFrame(
+                {patch_file.stem: parameter_values for patch_file, parameter_values in parsed}
+            )
+            self.values_df.sort_index(axis=1, inplace=True)
+            self.values_df.sort_index(axis=0, inplace=True)
+
+    def find_similar(self):
+        from patch_similarity import SimilarityIndex, feature_params
+
+        with self.profiler.stage("parse") as stage:
+            raw, _, patch_names = self.load_matrix(self.discovered_files(), feature_params())
+            stage["files"] = len(patch_names)
+        if self.args.similar not in patch_names:
+            print(f"No patch named {self.args.similar} in {self.patch_dir}")
+            return
+
+        with self.profiler.stage("index", len(patch_names)):
+            index = SimilarityIndex(raw, patch_names, lsh_bits=self.args.lsh)
+        with self.profiler.stage("query"):
+            similar = index.query(self.args.similar, self.args.top)
+        print(f"\n----------------- Patches like {self.args.similar} ---------------")
+        for patch_name, distance in similar:
+            print(f"{patch_name} : {distance:.3f}")
+
+    def load_matrix(self, patch_files, params=None):
+        # Straight to an int matrix in patch name order; no DataFrame of strings
+        patch_files = sorted(patch_files, key=lambda patch_file: patch_file.stem)
+        if self.cache or self.args.server:
+            named_values = ((patch_file.stem, values) for patch_file, values in self.read_patch_files(patch_files))
+            return pp.get_value_matrix(named_values, params)
+        return pp.get_value_matrix_from_files(patch_files, params, self.args.jobs, self.args.threads)
+
+    def where_matches(self):
+        from patch_query import PatchIndex
+
+        with self.profiler.stage("parse") as stage:
+            matrix, params, patch_names = self.load_matrix(self.discovered_files())
+            stage["files"] = len(patch_names)
+        with self.profiler.stage("query", len(patch_names)):
+            return PatchIndex(matrix, params, patch_names).query(self.args.conditions)
+
+    def find_where(self):
+        matches = self.where_matches()
+        print(f"\n----------------- {len(matches)} patches where {' and '.join(self.args.where)} ---------------")
+        for patch_name in matches:
+            print(patch_name)
+
+    def validate(self):
+        from patch_validate import validate_files
+
+        self.finish_scan()
+        patch_files = sorted(self.patch_files)
+        problems = validate_files(patch_files, self.args.jobs, self.args.threads)
+        for filepath, line, message in problems:
+            print(f"{filepath}:{line}: {message}")
+        print(f"{len(problems)} problems in {len({problem[0] for problem in problems})} of {len(patch_files)} patches")
+        if problems:
+            self.status = 1
+
+    def edit_patches(self):
+        import patch_writer
+
+        self.finish_scan()
+        patch_files = {patch_file.stem: patch_file for patch_file in self.patch_files}
+        edits = {}
+        if self.args.apply:
+            for patch_name, values in patch_writer.edits_from_csv(self.args.apply).items():
+                if patch_name in patch_files:
+                    edits[patch_name] = values
+                else:
+                    print(f"No patch named {patch_name} in {self.patch_dir}")
+        if self.args.set:
+            for patch_name in patch_files:
+                edits.setdefault(patch_name, {}).update(self.args.settings)
+        if self.args.where:
+            matches = set(self.where_matches())
+            edits = {patch_name: values for patch_name, values in edits.items() if patch_name in matches}
+        with self.profiler.stage("write", len(edits)):
+            try:
+                prepared = patch_writer.prepare_edits(
+                    (patch_files[patch_name], values) for patch_name, values in sorted(edits.items())
+                )
+            except ValueError as error:
+                # Refused before anything was written
+                print(error)
+                print("No patches written")
+                self.status = 1
+                return
+            count = 0
+            try:
+                for _ in patch_writer.write_prepared(prepared, self.args.out_dir):
+                    count += 1
+            except OSError as error:
+                print(f"Writing failed after {count} of {len(prepared)} patches: {error}")
+                self.status = 1
+                return
+        print(f"Wrote {count} patches to {self.args.out_dir or self.patch_dir}")
+
+    def diff(self):
+        import patch_diff
+
+        # Paths as given, or relative to --file_dir like --patch_file
+        path_a, path_b = (
+            path if path.exists() else Path(self.patch_dir, path) for path in map(Path, self.args.diff)
+        )
+        if path_a.is_dir() != path_b.is_dir():
+            print(f"Can't compare a bank with a patch: {path_a} {path_b}")
+            return
+        if path_a.is_dir():
+            with self.profiler.stage("parse") as stage:
+                banks = [
+                    self.load_matrix(scan_patch_files(path, self.args.glob or (), self.args.recursive, self.args.jobs))
+                    for path in (path_a, path_b)
+                ]
+                stage["files"] = sum(len(patch_names) for _, _, patch_names in banks)
+            (matrix_a, params, names_a), (matrix_b, _, names_b) = banks
+            with self.profiler.stage("diff", stage["files"]):
+                bank_diff = patch_diff.BankDiff(matrix_a, names_a, matrix_b, names_b, params)
+        else:
+            matrix, params, _ = pp.get_value_matrix(
+                (path.stem, values) for path, values in self.read_patch_files([path_a, path_b])
+            )
+            bank_diff = patch_diff.diff_patches(matrix, params, f"{path_a.stem} -> {path_b.stem}")
+        bank_diff.print(os.fspath(path_a), os.fspath(path_b), summary=path_a.is_dir())
+
+    def find_duplicates(self):
+        from patch_dedupe import DuplicateFinder
+
+        finder = DuplicateFinder(self.args.ignore or (), self.args.near)
+        for patch_file, parameter_values in self.read_patch_files(sorted(self.patch_files)):
+            finder.add(os.fspath(patch_file), parameter_values)
+        clusters = finder.clusters()
+        finder.write_csv(self.args.dedupe)
+        print(
+            f"{len(clusters)} duplicate clusters, {sum(len(members) for _, members in clusters)} patches:"
+            f" {self.args.dedupe}"
+        )
+
+    def read_patch_files(self, patch_files):
+        # (patch_file, parameter_values) in order, from the server or through the cache if there is one
+        if self.args.server:
+            from patch_server import get_parameter_values_from_server
+
+            return get_parameter_values_from_server(self.args.server, patch_files)
+        if self.cache:
+            return self.cache.get_parameter_values_from_files(patch_files, self.args.jobs, self.args.threads)
+        if self.args.steps:
+            # Values and step sequence in the same pass over each file
+            patches = pp.get_parameter_values_from_files(
+                patch_files, self.args.jobs, self.args.threads, parser=pp.get_patch_from_file
+            )
+            return self.keep_steps(patches)
+        return pp.get_parameter_values_from_files(patch_files, self.args.jobs, self.args.threads)
+
+    def keep_steps(self, patches):
+        for patch_file, (parameter_values, steps) in patches:
+            self.step_texts[patch_file.stem] = str(steps) or None
+            yield patch_file, parameter_values
 
     def dump_to_csv(self):
+        import pandas as pd
+
         csv_params = {}
         for patch_name, parameters in self.display_df.T.iterrows():
             display = {}
@@ -119,7 +401,164 @@ class App:
         csv_df.to_csv(self.args.csvname, index=False, index_label="Parameter")
         pass
 
+    def step_text(self, patch_file):
+        # Compact text of the patch's step sequence, None if it has none. Kept from parsing
+        # when it read the steps too; the server and the cache only hold values.
+        if patch_file.stem in self.step_texts:
+            return self.step_texts.pop(patch_file.stem)
+        return str(pp.get_step_sequence_from_file(patch_file)) or None
+
+    def output_params(self):
+        # Parameters in CSV row order
+        return [
+            param
+            for param, param_def in pp.param_definitions.items()
+            if self.args.unknown or param_def["TYPE"] != "UNK"
+        ]
+
+    def manifest_path(self):
+        return Path(f"{self.args.csvname}.manifest.json")
+
+    def manifest(self):
+        # What a CSV was built from: the options that shape it, and each file's mtime/size
+        return {
+            "options": {
+                "unknown": self.args.unknown,
+                "default": self.args.default,
+                "steps": self.args.steps,
+                "params": self.output_params(),
+            },
+            "files": {
+                patch_file.stem: [os.fspath(patch_file), stat.st_mtime_ns, stat.st_size]
+                for patch_file, stat in ((f, os.stat(f)) for f in self.patch_files)
+            },
+        }
+
+    def csv_stat(self):
+        # Ties the manifest to the CSV it describes, so a CSV rewritten by another run isn't patched
+        stat = os.stat(self.args.csvname)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def save_manifest(self, manifest=None):
+        manifest = manifest or self.manifest()
+        manifest["csv"] = self.csv_stat()
+        self.manifest_path().write_text(json.dumps(manifest))
+
+    def incremental_to_csv(self):
+        # Patch the CSV from the previous run: decode only added or modified files and drop
+        # removed ones. Returns False when there is no usable previous run to start from.
+        import pandas as pd
+        import patch_display
+
+        manifest_path = self.manifest_path()
+        if not manifest_path.exists() or not Path(self.args.csvname).exists():
+            return False
+        previous = json.loads(manifest_path.read_text())
+        manifest = self.manifest()
+        if previous["options"] != manifest["options"] or previous.get("csv") != self.csv_stat():
+            return False
+
+        changed = sorted(
+            (
+                patch_file
+                for patch_file in self.patch_files
+                if previous["files"].get(patch_file.stem) != manifest["files"][patch_file.stem]
+            ),
+            key=lambda patch_file: patch_file.stem,
+        )
+        removed = [stem for stem in previous["files"] if stem not in manifest["files"]]
+        logging.info(f"Incremental: {len(changed)} added or modified, {len(removed)} removed.")
+
+        csv_df = pd.read_csv(self.args.csvname, dtype=str, keep_default_na=False)
+        csv_df.drop(columns=removed, inplace=True)
+        if changed:
+            self.values_df = pd.DataFrame(
+                {
+                    patch_file.stem: parameter_values
+                    for patch_file, parameter_values in self.read_patch_files(changed)
+                }
+            )
+            params = manifest["options"]["params"]
+            changed_files = {patch_file.stem: patch_file for patch_file in changed}
+            display_df = patch_display.display_frame(self.values_df, self.args.default).reindex(params)
+            for patch_name in display_df.columns:
+                column = display_df[patch_name]
+                steps = [self.step_text(changed_files[patch_name])] if self.args.steps else []
+                csv_df[patch_name] = ["" if pd.isna(v) else str(v) for v in [*column, *steps]]
+                print(f"\n----------------- {patch_name} ---------------")
+                for p, v in column.items():
+                    if not pd.isna(v):
+                        print(f'{pp.param_definitions[p]["NAME"]} ={pp.param_definitions[p]["LOCATION"]}= : {v}')
+                for v in steps:
+                    if not pd.isna(v):
+                        print(f"Step Sequence =[STEP]= : {v}")
+        for patch_name in removed:
+            print(f"\n----------------- {patch_name} (removed) ---------------")
+
+        attributes = ["NAME", "LOCATION", "DEFAULT"]
+        patch_names = sorted(column for column in csv_df.columns if column not in attributes)
+        csv_df[attributes + patch_names].to_csv(self.args.csvname, index=False)
+        self.save_manifest(manifest)
+        return True
+
+    def output_attributes(self):
+        # NAME, LOCATION and display DEFAULT of each output row, steps last
+        params = self.output_params()
+        names = [pp.param_definitions[param]["NAME"] for param in params]
+        locations = [pp.param_definitions[param]["LOCATION"] for param in params]
+        defaults = [pp.get_display_value(param, pp.param_definitions[param]["DEFAULT"]) for param in params]
+        if self.args.steps:
+            names.append("Step Sequence")
+            locations.append("[STEP]")
+            defaults.append(None)
+        return params, names, locations, defaults
+
+    def read_display_values(self, params):
+        # (patch_file, display values) in patch name order, in plain Python
+        patch_files = sorted(self.patch_files, key=lambda patch_file: patch_file.stem)
+        for patch_file, parameter_values in self.read_patch_files(patch_files):
+            display = pp.get_display_values(parameter_values, params, self.args.default)
+            if self.args.steps:
+                display.append(self.step_text(patch_file))
+            yield patch_file, display
+
+    @staticmethod
+    def print_patch(patch_name, names, locations, display):
+        print(f"\n----------------- {patch_name} ---------------")
+        for name, location, value in zip(names, locations, display):
+            if value is not None:
+                print(f"{name} ={location}= : {value}")
+
+    def table_to_csv(self):
+        # Same console dump and CSV as the pandas pipeline, for banks small enough that
+        # importing pandas would cost more than the work itself
+        params, names, locations, defaults = self.output_attributes()
+        columns = {}
+        for patch_file, display in self.read_display_values(params):
+            columns[patch_file.stem] = display
+            self.print_patch(patch_file.stem, names, locations, display)
+        with open(self.args.csvname, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow(["NAME", "LOCATION", "DEFAULT", *columns])
+            for row, attributes in enumerate(zip(names, locations, defaults)):
+                writer.writerow([*attributes, *(display[row] for display in columns.values())])
+
+    def stream_to_csv(self):
+        # One CSV row per patch, written as each file is parsed, so memory stays flat
+        # however big the bank is. The layout is the transpose of dump_to_csv's.
+        params, names, locations, defaults = self.output_attributes()
+        with open(self.args.csvname, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow(["NAME"] + names)
+            writer.writerow(["LOCATION"] + locations)
+            writer.writerow(["DEFAULT"] + defaults)
+            for patch_file, display in self.read_display_values(params):
+                writer.writerow([patch_file.stem] + display)
+                self.print_patch(patch_file.stem, names, locations, display)
+
     def dump(self):
+        import pandas as pd
+
         # for name, parameters in (i for i in self.df.items() if i[0] not in ["LOCATION", "DEFAULT"]):
         for patch_name, parameters in (
             i
@@ -129,14 +568,16 @@ class App:
             print(f"\n----------------- {patch_name} ---------------")
             for p, v in parameters.items():
                 if not pd.isna(v):
-                    print(f'{self.param_attributes["NAME"][p]} ={self.param_attributes["LOCATION"][p]}= : {v}')
+                    print(f'{self.display_df["NAME"][p]} ={self.display_df["LOCATION"][p]}= : {v}')
 
     def cleanup(self):
         print(f"Cleaning up {self.args.app_name}.")
+        if self.cache:
+            self.cache.close()
 
 
 def parse_app_args(raw_args):
-    parser = argparse.ArgumentParser(raw_args)
+    parser = argparse.ArgumentParser()
     parser.add_argument(
         "--unknown",
         "-u",
@@ -158,6 +599,18 @@ def parse_app_args(raw_args):
         action="store",
         default="/Users/ed/Music/S-1 Patches - All Factory + UPV 1+2"
     )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        help="Also read patches in subdirectories of --file_dir (patch names are file stems, so keep them unique)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--glob",
+        help="Only read files whose names match this pattern, e.g. '*.PRM' (repeatable)",
+        action="append",
+    )
     parser.add_argument(
         "--patch_file",
         "-p",
@@ -165,7 +618,187 @@ def parse_app_args(raw_args):
         action="append",
     )
     parser.add_argument("--csvname", "-c", default="patches.csv")
-    return parser.parse_args()
+    parser.add_argument(
+        "--format",
+        "-f",
+        help="Also write a typed columnar file next to the CSV (npy if pyarrow is missing)",
+        choices=EXPORT_FORMATS,
+        default="csv",
+    )
+    parser.add_argument(
+        "--similar",
+        help="List the patches closest to this one (by file stem) instead of exporting",
+        action="store",
+    )
+    parser.add_argument(
+        "--top",
+        "-n",
+        help="Number of patches listed by --similar",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--lsh",
+        help="Search --similar through an LSH index with this many bits per hash instead of brute force",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--diff",
+        help="Print what changed between two patch files, or two bank directories, instead of exporting",
+        nargs=2,
+        metavar=("A", "B"),
+    )
+    parser.add_argument(
+        "--where",
+        help="List the patches matching PARAM OP VALUE conditions, e.g. 'ASSIGN_MODE=Chord,VCF_RESONANCE>200'"
+        " (OP is = != < <= > >=; repeatable, all must hold)",
+        action="append",
+    )
+    parser.add_argument(
+        "--validate",
+        help="Check every patch against the parameter definitions and list problems by file and line",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--set",
+        help="Write PARAM=VALUE into every patch (or those matching --where), in place unless --out_dir"
+        " (raw value, or display name for DICT params; repeatable)",
+        action="append",
+    )
+    parser.add_argument(
+        "--apply",
+        help="Write the raw values of an edits CSV (PATCH column, one column per parameter) into the patches",
+        action="store",
+    )
+    parser.add_argument(
+        "--out_dir",
+        help="Write patches edited by --set/--apply to this directory instead of over the originals",
+        action="store",
+    )
+    parser.add_argument(
+        "--dedupe",
+        help="Write clusters of duplicate patches to this CSV instead of exporting",
+        action="store",
+    )
+    parser.add_argument(
+        "--ignore",
+        help="Parameter to ignore when comparing patches for --dedupe",
+        action="append",
+    )
+    parser.add_argument(
+        "--near",
+        help="Also group patches differing in at most N parameters for --dedupe",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--steps",
+        help="Include each patch's step sequence in the output",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--stream",
+        "-s",
+        help="Write one CSV row per patch as files are read, without building the full table",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--incremental",
+        "-i",
+        help="Only re-export patches added, modified or removed since the last --incremental run",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache",
+        help="SQLite file caching parsed patches; unchanged files are not re-parsed",
+        action="store",
+    )
+    parser.add_argument(
+        "--cache_hash",
+        help="Also check a content hash before trusting a cache entry",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--server",
+        help="Read parameter values from a running patch_server.py at this URL instead of parsing",
+        action="store",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Time each stage (wall, CPU) and write the summary to this JSON file",
+        nargs="?",
+        const="profile.json",
+    )
+    parser.add_argument(
+        "--profile_memory",
+        help="With --profile, also trace each stage's allocations (much slower; times aren't comparable)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--pstats",
+        help="Write a cProfile dump of the whole run to this file (view with python -m pstats)",
+        action="store",
+    )
+    parser.add_argument(
+        "--log",
+        help="Append log messages to this file (no log file by default)",
+        action="store",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        help="Log at DEBUG instead of INFO level",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Parse files (and scan subdirectories with --recursive) with N parallel workers",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        help="Use threads instead of processes for --jobs (I/O-bound mounts)",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args(raw_args)
+    if args.where:
+        from patch_query import parse_conditions
+
+        try:
+            args.conditions = parse_conditions(args.where)
+        except ValueError as error:
+            parser.error(str(error))
+        if not args.conditions:
+            parser.error("--where needs at least one PARAM OP VALUE condition")
+    if args.set:
+        from patch_query import parse_conditions
+
+        try:
+            settings = parse_conditions(args.set, implied=False)
+        except ValueError as error:
+            parser.error(str(error))
+        if not settings or any(op != "=" for _, op, _ in settings):
+            parser.error("--set takes PARAM=VALUE")
+        args.settings = {param: value for param, _, value in settings}
+    if args.profile_memory and not args.profile:
+        args.profile = "profile.json"
+    if args.stream and args.incremental:
+        parser.error("--incremental cannot be combined with --stream")
+    if args.format != "csv" and (args.stream or args.incremental):
+        parser.error("--format needs the full table; it cannot be combined with --stream or --incremental")
+    return args
 
 
 if __name__ == "__main__":